@@ -1,20 +1,29 @@
 # -*- coding: utf-8 -*-
+import asyncio
+import threading
 import matplotlib
-import pandas as pd
+from datastore import DATASET
+from export import EXPORT_FORMATS, export_answers, parquet_available
+from storage import COLUMNS
 from helpers import  (check_new_data,
                       accuracy,
                       completeness,
                       accuracy_per_question_bar,
                       completeness_per_question_bar,
                       avg_of_scores_hist,
-                      instructor_feedback,
+                      instructor_feedback_stream,
                       get_courses,
                       get_quizzes)
 from shiny.express import input, output, render, ui
-from shiny import reactive
+from shiny import reactive, req
 from shinywidgets import output_widget, render_widget 
 matplotlib.use("agg")
 
+# Source Data grid: columns shown by default and length at which text cells are cut
+TABLE_COLUMNS = ['question_name', 'submission_id', 'attempt', 'student_answer', 'accuracy', 'completeness']
+TABLE_TEXT_CHARS = 120
+SCORE_FILTER = {"": "Any", "1": "1", "2": "2", "3": "3", "4": "4"}
+
 ui.tags.style(
     """
     /* Don't apply fade effect, it's constantly recalculating */
@@ -50,6 +59,53 @@ with ui.sidebar():
 
 
     ui.input_action_button("generate", "Generate Reports"),
+    ui.input_action_button("cancel", "Cancel"),
+
+    # Progress of the current sync, written by the worker thread and polled by sync_status
+    sync_progress = {'message': ''}
+
+    async def run_in_background(function, *args, **kwargs):
+        """
+        Runs a blocking function on a worker thread so the event loop keeps serving
+        every other session. Cancelling the awaiting task sets the function's
+        cancel event, which it checks between steps, and waits for the function
+        to return (storing what it already did) before the task ends as cancelled.
+        """
+        cancel = threading.Event()
+        worker = asyncio.ensure_future(asyncio.to_thread(function, *args, cancel=cancel, **kwargs))
+        try:
+            return await asyncio.shield(worker)
+        except asyncio.CancelledError:
+            cancel.set()
+            while not worker.done():
+                try:
+                    await asyncio.wait({worker})
+                except asyncio.CancelledError:
+                    pass
+            raise
+
+    @reactive.extended_task
+    async def sync_task(course, quiz, apikey, azurekey, endpoint):
+        def progress(message):
+            sync_progress['message'] = message
+
+        return await run_in_background(check_new_data, course, quiz, apikey, azurekey, endpoint,
+                                       progress=progress)
+
+    @render.text
+    def sync_status():
+        status = sync_task.status()
+        if status == 'running':
+            reactive.invalidate_later(1)
+            return sync_progress['message'] or "Syncing with Canvas..."
+        if status == 'success':
+            graded = sync_task.result()
+            return "Quiz could not be fetched" if graded is None else f"Graded {graded} new answers"
+        if status == 'error':
+            return "Sync failed, showing the stored data"
+        if status == 'cancelled':
+            return "Sync cancelled, showing the stored data"
+        return ""
 
     #API key entry to fetch all courses
     @reactive.effect
@@ -78,58 +134,196 @@ with ui.sidebar():
 with ui.panel_absolute(width="75%"):
     # Enable busy indicators
     with ui.navset_bar(title="Student Performance"):
+        # Bumped when a sync's worker thread has returned, so the reports below redraw from
+        # the stored data, and when a sync succeeded, which also regenerates the feedback
+        refreshed = reactive.value(0)
+        synced = reactive.value(0)
+
+        @reactive.effect
         @reactive.event(input.generate)
         def _():
-            check_new_data(input.course(), input.cae(), input.apikey(), input.azurekey(), input.endpoint())     
+            sync_progress['message'] = ''
+            sync_task.invoke(input.course(), input.cae(), input.apikey(), input.azurekey(), input.endpoint())
+
+        @reactive.effect
+        def _():
+            status = sync_task.status()
+            if status in ('success', 'error', 'cancelled'):
+                with reactive.isolate():
+                    refreshed.set(refreshed() + 1)
+                    if status == 'success':
+                        synced.set(synced() + 1)
+
+        @reactive.effect
+        @reactive.event(input.cancel)
+        def _():
+            if sync_task.status() == 'running':
+                sync_progress['message'] = "Cancelling, storing the answers graded so far..."
+            sync_task.cancel()
+            if feedback.latest_stream.status() == 'running':
+                feedback.latest_stream.cancel()
 
         with ui.nav_panel(title="Graphs"):
             @render_widget
-            @reactive.event(input.generate)
+            @reactive.event(refreshed, ignore_init=True)
             def plot_average_accuracy_per_question_bar():
                 return accuracy_per_question_bar(input.course(), input.cae())
 
 
             @render_widget
-            @reactive.event(input.generate)
+            @reactive.event(refreshed, ignore_init=True)
             def plot_completeness_accuracy_per_question_bar():
                 return completeness_per_question_bar(input.course(), input.cae())
 
 
             @render_widget
-            @reactive.event(input.generate)
+            @reactive.event(refreshed, ignore_init=True)
             def plot_avg_of_scores_hist():
                 return avg_of_scores_hist(input.course(), input.cae())
 
 
             @render_widget
-            @reactive.event(input.generate)
+            @reactive.event(refreshed, ignore_init=True)
             def plot_accuracy():
                 return accuracy(input.course(), input.cae())
 
 
             @render_widget
-            @reactive.event(input.generate)
+            @reactive.event(refreshed, ignore_init=True)
             def plot_completeness():
                 return completeness(input.course(), input.cae())
 
 
         with ui.nav_panel(title="Topics"):
-            @render.text
-            @reactive.event(input.generate)
-            def feedback():
-                return instructor_feedback(input.course(), input.cae(), input.azurekey(), input.endpoint())
+            feedback = ui.MarkdownStream("feedback")
+            # The latest progress line of the feedback stream, cleared when the summary starts
+            feedback_progress = {'message': ''}
+
+            @render.ui
+            def feedback_status():
+                if feedback.latest_stream.status() != 'running':
+                    return None
+                reactive.invalidate_later(1)
+                return ui.em(feedback_progress['message']) if feedback_progress['message'] else None
+
+            feedback.ui()
+
+            async def feedback_markdown(course, quiz, azurekey, endpoint):
+                """
+                Renders the feedback events as markdown: the per question summaries
+                as they complete, then the quiz summary as it is generated. Progress
+                events are shown by feedback_status until the summary starts.
+                """
+                feedback_progress['message'] = "Generating feedback..."
+                summary_started = False
+                try:
+                    async for kind, text in instructor_feedback_stream(course, quiz, azurekey, endpoint):
+                        if kind == 'progress':
+                            if not summary_started:
+                                feedback_progress['message'] = text
+                        elif kind == 'question':
+                            yield f"- {text}\n"
+                        elif kind == 'token':
+                            if not summary_started:
+                                summary_started = True
+                                feedback_progress['message'] = ''
+                                yield "\n**Summary**\n\n"
+                            yield text
+                finally:
+                    feedback_progress['message'] = ''
+
+            @reactive.effect
+            @reactive.event(synced, ignore_init=True)
+            def _():
+                feedback.stream(feedback_markdown(input.course(), input.cae(), input.azurekey(), input.endpoint()))
 
         with ui.nav_panel(title="Source Data"):
-            @render.download(label="Download CSV", filename="data.csv")
-            @reactive.event(input.download)
+            ui.input_selectize("export_quizzes", "Quizzes to export (the whole course if empty)",
+                               choices={}, multiple=True)
+            ui.input_radio_buttons("export_format", "Format",
+                                   choices={key: label for key, label in EXPORT_FORMATS.items()
+                                            if key != 'parquet' or parquet_available()},
+                                   inline=True)
+
+            @reactive.effect
+            @reactive.event(input.next, refreshed)
+            def _():
+                if input.course().isdigit():
+                    ui.update_selectize("export_quizzes", choices=DATASET.course_quizzes(input.course()))
+
+            @render.download(label="Download",
+                             filename=lambda: f"graded_answers_{input.course()}.{input.export_format()}")
+            def _():
+                yield from export_answers(DATASET, input.course(), list(input.export_quizzes()),
+                                          input.export_format())
+
+            with ui.layout_columns():
+                ui.input_text("table_search", "Search questions and answers")
+                ui.input_select("table_accuracy", "Accuracy", choices=SCORE_FILTER)
+                ui.input_select("table_completeness", "Completeness", choices=SCORE_FILTER)
+                ui.input_select("table_page_size", "Rows per page", choices=["25", "50", "100"], selected="50")
+            ui.input_selectize("table_columns", "Columns", choices=COLUMNS, selected=TABLE_COLUMNS, multiple=True)
+
+            # Page of the grid shown, the rows are read from the store one page at a time
+            table_page = reactive.value(0)
+
+            @reactive.effect
+            @reactive.event(input.table_search, input.table_accuracy, input.table_completeness,
+                            input.table_page_size, refreshed)
+            def _():
+                table_page.set(0)
+
+            @reactive.calc
+            def table_data():
+                req(refreshed() > 0, input.table_columns())
+                size = int(input.table_page_size())
+                return DATASET.page(input.course(), input.cae(), list(input.table_columns()),
+                                    offset=table_page() * size, limit=size,
+                                    filters={'accuracy': input.table_accuracy(),
+                                             'completeness': input.table_completeness()},
+                                    search=input.table_search(), truncate=TABLE_TEXT_CHARS)
+
+            @reactive.effect
+            @reactive.event(input.table_previous)
+            def _():
+                table_page.set(max(table_page() - 1, 0))
+
+            @reactive.effect
+            @reactive.event(input.table_next)
             def _():
-                df = pd.read_json('Data/graded_quizzes.json')
-                subset = df[(df['quiz_id']==int(input.cae())) & (df['course_id']==int(input.course()))]
-                yield subset.to_csv()
+                page, total = table_data()
+                if (table_page() + 1) * int(input.table_page_size()) < total:
+                    table_page.set(table_page() + 1)
+
+            with ui.layout_columns():
+                ui.input_action_button("table_previous", "Previous")
+
+                @render.text
+                def table_position():
+                    page, total = table_data()
+                    first = table_page() * int(input.table_page_size())
+                    return f"Rows {min(first + 1, total)}-{first + len(page)} of {total}"
+
+                ui.input_action_button("table_next", "Next")
 
             @render.data_frame
-            @reactive.event(input.generate)
             def table():
-                df = pd.read_json('Data/graded_quizzes.json')
-                subset = df[(df['quiz_id']==int(input.cae())) & (df['course_id']==int(input.course()))]
-                return render.DataGrid(subset)
\ No newline at end of file
+                page, total = table_data()
+                return render.DataGrid(page.drop(columns='id'), selection_mode="row")
+
+            # The full text of the selected row, read on demand
+            @render.ui
+            def table_row():
+                rows = table.cell_selection()['rows']
+                req(rows)
+                page, total = table_data()
+                answer = DATASET.answer(page['id'].iloc[rows[0]])
+                req(answer)
+                return ui.card(
+                    ui.card_header(f"{answer['question_name']} - submission {answer['submission_id']}, "
+                                   f"attempt {answer['attempt']}"),
+                    ui.tags.dl(*[tag for column in ['question_text', 'question_answer', 'student_answer']
+                                 for tag in (ui.tags.dt(column.replace('_', ' ').capitalize()),
+                                             ui.tags.dd(answer[column] or ''))]),
+                    ui.p(f"Accuracy {answer['accuracy']}, completeness {answer['completeness']}"),
+                )
\ No newline at end of file
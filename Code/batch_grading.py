@@ -0,0 +1,250 @@
+# -*- coding: utf-8 -*-
+"""Azure OpenAI Batch API grading mode, plus an offline stand-in for the batch endpoint."""
+
+import hashlib
+import io
+import json
+import os
+import time
+from types import SimpleNamespace
+
+BATCH_API_VERSION = "2024-10-21"
+BATCH_DEPLOYMENT = os.environ.get('ALAS_BATCH_DEPLOYMENT', 'gpt-4o-batch')
+POLL_INTERVAL = float(os.environ.get('ALAS_BATCH_POLL_SECONDS', '60'))
+BATCH_MOCK = os.environ.get('ALAS_BATCH_MOCK', 'off')  # 'on' to grade batches offline with MockBatchClient
+FINISHED_STATUSES = {'completed', 'failed', 'expired', 'cancelled'}
+
+
+def answer_key(answer):
+    """
+    Returns the custom_id identifying an answer inside a batch.
+
+    Args:
+        answer (dict): The graded answer dictionary.
+
+    Returns:
+        custom_id (str): submission_id-question_id-attempt
+    """
+    return f"{answer['submission_id']}-{answer['history_id']}-{answer['attempt']}"
+
+
+def build_batch(answers, request, model=BATCH_DEPLOYMENT):
+    """
+    Writes one chat completion request per answer as Batch API JSONL.
+
+    Args:
+        answers (list): The answer dictionaries to grade.
+        request (callable): Takes an answer dictionary and returns its chat completion
+            arguments (messages, tools, ...).
+        model (str): The batch deployment name.
+
+    Returns:
+        jsonl (bytes): The batch input file.
+    """
+    lines = []
+    for answer in answers:
+        lines.append(json.dumps({'custom_id': answer_key(answer),
+                                 'method': 'POST',
+                                 'url': '/chat/completions',
+                                 'body': dict(request(answer), model=model)}))
+    return ('\n'.join(lines) + '\n').encode('utf-8')
+
+
+def submit_batch(client, jsonl):
+    """
+    Uploads a batch input file and starts the batch.
+
+    Args:
+        client (AzureOpenAI): A client created with BATCH_API_VERSION.
+        jsonl (bytes): The batch input file.
+
+    Returns:
+        batch_id (str): The ID of the created batch.
+    """
+    input_file = client.files.create(file=('grading.jsonl', io.BytesIO(jsonl)), purpose='batch')
+    batch = client.batches.create(input_file_id=input_file.id,
+                                  endpoint='/chat/completions',
+                                  completion_window='24h')
+    return batch.id
+
+
+def wait_for_batch(client, batch_id, poll_interval=POLL_INTERVAL, cancel=None):
+    """
+    Polls a batch until it has finished.
+
+    Args:
+        client (AzureOpenAI): A client created with BATCH_API_VERSION.
+        batch_id (str): The batch ID.
+        poll_interval (float): The number of seconds between polls.
+        cancel (threading.Event): Once set, the batch is cancelled and its state is
+            returned without waiting for it to finish.
+
+    Returns:
+        batch: The finished (or cancelled) batch object.
+    """
+    while True:
+        batch = client.batches.retrieve(batch_id)
+        if batch.status in FINISHED_STATUSES:
+            return batch
+        if cancel is None:
+            time.sleep(poll_interval)
+        elif cancel.wait(poll_interval):
+            return client.batches.cancel(batch_id)
+
+
+def read_batch_output(client, batch):
+    """
+    Downloads the replies of a finished batch.
+
+    Args:
+        client (AzureOpenAI): A client created with BATCH_API_VERSION.
+        batch: The finished batch object.
+
+    Returns:
+        replies (dict): The reply message (a dict) keyed by custom_id. Failed requests are left out.
+    """
+    replies = {}
+    if not batch.output_file_id:
+        return replies
+    for line in client.files.content(batch.output_file_id).text.splitlines():
+        if not line.strip():
+            continue
+        result = json.loads(line)
+        response = result.get('response') or {}
+        if response.get('status_code') != 200:
+            continue
+        replies[result['custom_id']] = response['body']['choices'][0]['message']
+    return replies
+
+
+def grade_batch(answers, client, request, parse, model=BATCH_DEPLOYMENT, poll_interval=POLL_INTERVAL,
+                cancel=None):
+    """
+    Grades answers through the Batch API and merges the scores back into them.
+
+    Args:
+        answers (list): The answer dictionaries to grade.
+        client (AzureOpenAI): A client created with BATCH_API_VERSION.
+        request (callable): Takes an answer dictionary and returns its chat completion arguments.
+        parse (callable): Takes a reply message dict and returns (accuracy, completeness).
+        model (str): The batch deployment name.
+        poll_interval (float): The number of seconds between polls.
+        cancel (threading.Event): Set to cancel the batch (see wait_for_batch).
+
+    Returns:
+        graded (list): The answers that were graded, in their original order. Answers
+            whose request failed or whose reply could not be parsed are reported and left out.
+    """
+    if not answers or (cancel is not None and cancel.is_set()):
+        return []
+    batch_id = submit_batch(client, build_batch(answers, request, model))
+    print(f"Submitted grading batch {batch_id} with {len(answers)} answers")
+    batch = wait_for_batch(client, batch_id, poll_interval, cancel)
+    if batch.status != 'completed':
+        print(f"Grading batch {batch_id} finished with status {batch.status}")
+    replies = read_batch_output(client, batch)
+
+    graded = []
+    for answer in answers:
+        reply = replies.get(answer_key(answer))
+        if reply is None:
+            print(f"No batch reply for answer {answer_key(answer)}")
+            continue
+        try:
+            answer['accuracy'], answer['completeness'] = parse(reply)
+        except Exception as e:
+            print(f"Error parsing batch reply for answer {answer_key(answer)}: {e}")
+            continue
+        graded.append(answer)
+    return graded
+
+
+def mock_reply(body):
+    """
+    Deterministic stand-in for a record_grade reply message, derived from the request content.
+    """
+    digest = hashlib.sha256(json.dumps(body['messages']).encode('utf-8')).digest()
+    arguments = json.dumps({'accuracy': digest[0] % 4 + 1,
+                            'completeness': digest[1] % 4 + 1,
+                            'explanation': 'Mock grade.'})
+    return {'role': 'assistant',
+            'content': None,
+            'tool_calls': [{'id': 'call_mock',
+                            'type': 'function',
+                            'function': {'name': 'record_grade', 'arguments': arguments}}]}
+
+
+class MockBatchClient:
+    """
+    An in-process stand-in for the files and batches endpoints of AzureOpenAI, so the
+    batch mode can be run offline. A batch reports in_progress for `polls` polls and
+    then completes, with every request answered by the message `reply(body)`.
+    Its grades are cached under cache_model, apart from the real deployment's.
+    """
+
+    cache_model = 'mock-batch'
+
+    def __init__(self, reply=mock_reply, polls=1):
+        self.reply = reply
+        self.polls = polls
+        self._files = {}
+        self._batches = {}
+        self.files = SimpleNamespace(create=self._create_file, content=self._file_content)
+        self.batches = SimpleNamespace(create=self._create_batch, retrieve=self._retrieve_batch,
+                                       cancel=self._cancel_batch)
+
+    def _create_file(self, file, purpose):
+        """
+        Stores an uploaded file.
+        """
+        name, data = file if isinstance(file, tuple) else ('upload', file)
+        content = data.read() if hasattr(data, 'read') else data
+        file_id = f"file-{len(self._files) + 1}"
+        self._files[file_id] = content.decode('utf-8') if isinstance(content, bytes) else content
+        return SimpleNamespace(id=file_id, filename=name, purpose=purpose)
+
+    def _file_content(self, file_id):
+        """
+        Returns a stored file.
+        """
+        return SimpleNamespace(text=self._files[file_id])
+
+    def _create_batch(self, input_file_id, endpoint, completion_window):
+        """
+        Queues a batch over an uploaded input file.
+        """
+        batch_id = f"batch-{len(self._batches) + 1}"
+        self._batches[batch_id] = {'input_file_id': input_file_id, 'polls': 0, 'output_file_id': None}
+        return SimpleNamespace(id=batch_id, status='validating')
+
+    def _retrieve_batch(self, batch_id):
+        """
+        Reports the status of a batch, running it once it has been polled enough.
+        """
+        batch = self._batches[batch_id]
+        batch['polls'] += 1
+        if batch.get('cancelled'):
+            return SimpleNamespace(id=batch_id, status='cancelled', output_file_id=None)
+        if batch['polls'] <= self.polls:
+            return SimpleNamespace(id=batch_id, status='in_progress', output_file_id=None)
+
+        if batch['output_file_id'] is None:
+            lines = []
+            for line in self._files[batch['input_file_id']].splitlines():
+                request = json.loads(line)
+                body = {'choices': [{'message': self.reply(request['body'])}]}
+                lines.append(json.dumps({'custom_id': request['custom_id'],
+                                         'response': {'status_code': 200, 'body': body}}))
+            batch['output_file_id'] = f"file-{len(self._files) + 1}"
+            self._files[batch['output_file_id']] = '\n'.join(lines) + '\n'
+        return SimpleNamespace(id=batch_id, status='completed', output_file_id=batch['output_file_id'])
+
+    def _cancel_batch(self, batch_id):
+        """
+        Cancels a batch that has not completed yet.
+        """
+        batch = self._batches[batch_id]
+        if batch['output_file_id'] is None:
+            batch['cancelled'] = True
+            return SimpleNamespace(id=batch_id, status='cancelled', output_file_id=None)
+        return SimpleNamespace(id=batch_id, status='completed', output_file_id=batch['output_file_id'])
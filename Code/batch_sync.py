@@ -0,0 +1,125 @@
+# -*- coding: utf-8 -*-
+"""
+Headless sync and grading of every Consolidation quiz in a list of courses.
+
+Jobs are kept in the sync_jobs table of the database, so a run that is
+interrupted picks up where it stopped when it is started again:
+
+    python batch_sync.py --courses 123456 234567
+    python batch_sync.py --resume
+
+Credentials are read from the command line or from the ALAS_CANVAS_KEY,
+ALAS_AZURE_KEY and ALAS_AZURE_ENDPOINT environment variables (a .env file is
+loaded if present). With --mode batch --mock-batch (or ALAS_BATCH_MOCK=on) the
+batches are graded offline by MockBatchClient instead of the Batch API.
+"""
+
+import argparse
+import os
+from dotenv import load_dotenv
+import storage
+from datastore import DATASET
+from grading import GRADING_CONCURRENCY
+from batch_grading import MockBatchClient
+from helpers import GRADING_MODE, check_new_data, get_quizzes
+
+
+def enqueue(apikey, courses):
+    """
+    Queues a sync job for every Consolidation quiz of the given courses.
+
+    Args:
+        apikey (str): The Canvas API key.
+        courses (list): The course IDs.
+
+    Returns:
+        queued (int): The number of quizzes queued.
+    """
+    jobs = []
+    for course in courses:
+        quizzes = get_quizzes(apikey, str(course))
+        jobs.extend((course, quiz, title) for quiz, title in quizzes.items())
+    storage.enqueue_jobs(jobs, DATASET.engine)
+    return len(jobs)
+
+
+def run(apikey, azurekey, endpoint, concurrency=GRADING_CONCURRENCY, max_attempts=3, mode=GRADING_MODE,
+        batch_client=None):
+    """
+    Works through the job queue until no unfinished job is left.
+
+    Args:
+        apikey (str): The Canvas API key.
+        azurekey (str): The Azure API key.
+        endpoint (str): The Azure endpoint.
+        concurrency (int): The maximum number of concurrent grading calls.
+        max_attempts (int): The number of times a job is tried before it is given up.
+        mode (str): 'sync', 'grouped' or 'batch' (see check_new_data).
+        batch_client: The client used in batch mode, defaults to helpers.get_batch_client().
+
+    Returns:
+        counts (dict): The number of jobs in each status after the run.
+    """
+    while True:
+        job = storage.claim_job(max_attempts, DATASET.engine)
+        if job is None:
+            break
+        retry = 'failed' if job['attempts'] + 1 >= max_attempts else 'pending'
+        print(f"Syncing course {job['course_id']} quiz {job['quiz_id']} "
+              f"({job['quiz_title']}), attempt {job['attempts'] + 1}")
+        try:
+            graded = check_new_data(str(job['course_id']), str(job['quiz_id']),
+                                    apikey, azurekey, endpoint, concurrency, mode, batch_client)
+        except Exception as e:
+            print(f"Error syncing quiz {job['quiz_id']}: {e}")
+            storage.finish_job(job['id'], retry, error=str(e), engine=DATASET.engine)
+            continue
+
+        if graded is None:
+            storage.finish_job(job['id'], retry, error="Quiz could not be fetched",
+                               engine=DATASET.engine)
+        else:
+            print(f"Graded {graded} new answers")
+            storage.finish_job(job['id'], 'done', graded=graded, engine=DATASET.engine)
+
+    return storage.job_counts(DATASET.engine)
+
+
+def main():
+    """
+    Parses the command line, queues the requested courses and runs the queue.
+    """
+    load_dotenv()
+    parser = argparse.ArgumentParser(description="Sync and grade Consolidation quizzes from Canvas.")
+    parser.add_argument('--courses', nargs='*', default=[], help="Course IDs to queue.")
+    parser.add_argument('--resume', action='store_true',
+                        help="Only finish the jobs already in the queue.")
+    parser.add_argument('--canvas-key', default=os.environ.get('ALAS_CANVAS_KEY'))
+    parser.add_argument('--azure-key', default=os.environ.get('ALAS_AZURE_KEY'))
+    parser.add_argument('--azure-endpoint', default=os.environ.get('ALAS_AZURE_ENDPOINT'))
+    parser.add_argument('--concurrency', type=int, default=GRADING_CONCURRENCY,
+                        help="Maximum number of concurrent grading calls.")
+    parser.add_argument('--mode', choices=['sync', 'grouped', 'batch'], default=GRADING_MODE,
+                        help="Grade one answer per request, several per request, or through the Batch API.")
+    parser.add_argument('--mock-batch', action='store_true',
+                        help="In batch mode, grade with the offline mock batch endpoint.")
+    parser.add_argument('--max-attempts', type=int, default=3,
+                        help="Number of times a failing quiz is retried.")
+    args = parser.parse_args()
+
+    if not (args.canvas_key and args.azure_key and args.azure_endpoint):
+        parser.error("Canvas key, Azure key and Azure endpoint are required")
+    if not args.resume and not args.courses:
+        parser.error("Pass --courses to queue, or --resume to finish the existing queue")
+
+    if not args.resume:
+        print(f"Queued {enqueue(args.canvas_key, args.courses)} quizzes")
+
+    counts = run(args.canvas_key, args.azure_key, args.azure_endpoint,
+                 args.concurrency, args.max_attempts, args.mode,
+                 MockBatchClient() if args.mock_batch else None)
+    print("Jobs:", ", ".join(f"{count} {status}" for status, count in sorted(counts.items())))
+
+
+if __name__ == '__main__':
+    main()
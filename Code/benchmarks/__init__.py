@@ -0,0 +1,10 @@
+# -*- coding: utf-8 -*-
+"""
+Offline benchmarks for syncing, plotting and feedback at scaled data sizes.
+
+Everything runs against local stand-ins: a synthetic dataset (synthetic.py),
+a mock Canvas API (mock_canvas.py) and a mock Azure OpenAI endpoint
+(mock_azure.py). Run from the Code directory:
+
+    python -m benchmarks.run --students 1000 --latency 0.2 --rate-limit 0.05
+"""
@@ -0,0 +1,167 @@
+# -*- coding: utf-8 -*-
+"""A local stand-in for the Azure OpenAI chat completions endpoint, with latency and 429s."""
+
+import json
+import random
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from batch_grading import mock_reply
+
+FEEDBACK_REPLY = ("For Accuracy, students commonly described how the main mechanism changes with load, "
+                  "but several confused cause and effect. For Completeness, most answers omitted the "
+                  "regulatory step and the expected clinical consequence.")
+STREAM_PIECE_WORDS = 4
+
+
+class MockAzure:
+    """
+    Answers POST /openai/deployments/<deployment>/chat/completions on a local port,
+    in the shapes the app asks for: a record_grade tool call when tools are sent,
+    a {"grades": [...]} object for grouped grading, a server-sent event stream
+    when stream is set, and a short feedback text otherwise. Grades come from
+    batch_grading.mock_reply, so they are deterministic.
+
+    Each request sleeps latency seconds (plus up to jitter), and a rate_limit share
+    of requests is refused with a 429 and retry-after headers before any work is
+    done. Point the app at it with the endpoint server.endpoint and any key.
+
+    Args:
+        latency (float): Seconds slept before each completion.
+        jitter (float): Extra random seconds, uniform from 0 to jitter.
+        rate_limit (float): The probability of answering a request with a 429.
+        retry_after (float): The retry-after sent with a 429, in seconds.
+        seed (int): The random seed of the jitter and the 429s.
+        port (int): The port to listen on, 0 for any free port.
+    """
+
+    def __init__(self, latency=0.0, jitter=0.0, rate_limit=0.0, retry_after=0.1, seed=0, port=0):
+        self.latency = latency
+        self.jitter = jitter
+        self.rate_limit = rate_limit
+        self.retry_after = retry_after
+        self.requests = 0
+        self.rate_limited = 0
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self._server = ThreadingHTTPServer(('127.0.0.1', port), self._handler())
+        self._server.daemon_threads = True
+        self._thread = None
+
+    @property
+    def endpoint(self):
+        return f"http://127.0.0.1:{self._server.server_address[1]}/"
+
+    def start(self):
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    def _admit(self):
+        """
+        Counts a request and returns (refused, delay): whether it gets a 429 and how long to sleep otherwise.
+        """
+        with self._lock:
+            self.requests += 1
+            refused = self._random.random() < self.rate_limit
+            if refused:
+                self.rate_limited += 1
+            delay = self.latency + self._random.uniform(0, self.jitter)
+        return refused, delay
+
+    def message(self, body):
+        """
+        Returns the assistant message replying to a chat completions request body.
+        """
+        if body.get('tools'):
+            return mock_reply(body)
+        if (body.get('response_format') or {}).get('type') == 'json_object':
+            prompt = body['messages'][-1]['content']
+            match = re.search(r'Student Answers:(\[.*\])\s*$', prompt, re.DOTALL)
+            answers = json.loads(match[1]) if match else []
+            grades = []
+            for answer in answers:
+                arguments = json.loads(mock_reply({'messages': [answer]})['tool_calls'][0]['function']['arguments'])
+                grades.append({'id': answer['id'],
+                               'accuracy': arguments['accuracy'],
+                               'completeness': arguments['completeness']})
+            return {'role': 'assistant', 'content': json.dumps({'grades': grades})}
+        return {'role': 'assistant', 'content': FEEDBACK_REPLY}
+
+    def _handler(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def log_message(self, format, *args):
+                pass
+
+            def do_POST(self):
+                body = json.loads(self.rfile.read(int(self.headers.get('Content-Length', 0))) or b'{}')
+                if not re.fullmatch(r'/openai/deployments/[^/]+/chat/completions', self.path.split('?')[0]):
+                    return self._send_json(404, {'error': {'code': '404', 'message': 'Resource not found'}})
+
+                refused, delay = server._admit()
+                if refused:
+                    return self._send_json(429, {'error': {'code': '429', 'message': 'Rate limit is exceeded.'}},
+                                           {'retry-after': str(server.retry_after),
+                                            'retry-after-ms': str(int(server.retry_after * 1000))})
+                time.sleep(delay)
+                message = server.message(body)
+                if body.get('stream'):
+                    return self._send_stream(body, message['content'])
+                self._send_json(200, {'id': 'chatcmpl-mock',
+                                      'object': 'chat.completion',
+                                      'created': int(time.time()),
+                                      'model': body.get('model', 'mock'),
+                                      'choices': [{'index': 0,
+                                                   'message': message,
+                                                   'finish_reason': 'tool_calls' if message.get('tool_calls')
+                                                   else 'stop'}],
+                                      'usage': {'prompt_tokens': 0, 'completion_tokens': 0, 'total_tokens': 0}})
+
+            def _send_json(self, status, data, headers=None):
+                body = json.dumps(data).encode('utf-8')
+                self.send_response(status)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(body)))
+                for name, value in (headers or {}).items():
+                    self.send_header(name, value)
+                self.end_headers()
+                self.wfile.write(body)
+
+            def _send_stream(self, body, content):
+                self.send_response(200)
+                self.send_header('Content-Type', 'text/event-stream')
+                self.send_header('Connection', 'close')
+                self.end_headers()
+                words = content.split(' ')
+                pieces = [' '.join(words[i:i + STREAM_PIECE_WORDS]) + ' '
+                          for i in range(0, len(words), STREAM_PIECE_WORDS)]
+                for piece in pieces + [None]:
+                    chunk = {'id': 'chatcmpl-mock',
+                             'object': 'chat.completion.chunk',
+                             'created': int(time.time()),
+                             'model': body.get('model', 'mock'),
+                             'choices': [{'index': 0,
+                                          'delta': {'content': piece} if piece else {},
+                                          'finish_reason': None if piece else 'stop'}]}
+                    self.wfile.write(f"data: {json.dumps(chunk)}\n\n".encode('utf-8'))
+                    self.wfile.flush()
+                self.wfile.write(b"data: [DONE]\n\n")
+                self.wfile.flush()
+                self.close_connection = True
+
+        return Handler
@@ -0,0 +1,141 @@
+# -*- coding: utf-8 -*-
+"""A local stand-in for the Canvas endpoints used by helpers.py, serving a synthetic fixture."""
+
+import json
+import re
+import threading
+import time
+from datetime import datetime
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlencode, urlparse
+
+RATE_LIMIT_BUDGET = 700.0
+REQUEST_COST = 1.0
+
+
+class MockCanvas:
+    """
+    Serves courses, quizzes, questions and submissions from a fixture (see
+    synthetic.generate) on a local port.
+
+    Listings are paginated with page and per_page, and every page carries the Link
+    header (next and last) and the X-Rate-Limit-Remaining / X-Request-Cost headers
+    that canvas.CanvasClient reads. Submissions honour assignment_ids[] and
+    submitted_since. Point the app at it with ALAS_CANVAS_BASE_URL=server.base_url.
+
+    Args:
+        fixture (dict): The output of synthetic.generate().
+        latency (float): Seconds slept before each response.
+        port (int): The port to listen on, 0 for any free port.
+    """
+
+    def __init__(self, fixture, latency=0.0, port=0):
+        self.fixture = fixture
+        self.latency = latency
+        self.requests = 0
+        self._lock = threading.Lock()
+        self._server = ThreadingHTTPServer(('127.0.0.1', port), self._handler())
+        self._server.daemon_threads = True
+        self._thread = None
+
+    @property
+    def base_url(self):
+        return f"http://127.0.0.1:{self._server.server_address[1]}/api/v1/"
+
+    def start(self):
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    def route(self, path, query):
+        """
+        Returns the items of a path, or None for an unknown path.
+
+        Returns:
+            data: A list for listings, a dictionary for single objects.
+        """
+        fixture = self.fixture
+        if path == 'courses':
+            return fixture['courses']
+        match = re.fullmatch(r'courses/(\d+)/quizzes', path)
+        if match:
+            return fixture['quizzes'].get(int(match[1]))
+        match = re.fullmatch(r'courses/(\d+)/quizzes/(\d+)', path)
+        if match:
+            return next((quiz for quiz in fixture['quizzes'].get(int(match[1]), [])
+                         if quiz['id'] == int(match[2])), None)
+        match = re.fullmatch(r'courses/(\d+)/quizzes/(\d+)/questions', path)
+        if match:
+            return fixture['questions'].get(int(match[2]))
+        match = re.fullmatch(r'courses/(\d+)/students/submissions', path)
+        if match:
+            submissions = []
+            for assignment_id in query.get('assignment_ids[]', []):
+                submissions.extend(fixture['submissions'].get(int(assignment_id), []))
+            since = query.get('submitted_since', [None])[0]
+            if since:
+                since = datetime.fromisoformat(since.replace('Z', '+00:00'))
+                submissions = [submission for submission in submissions
+                               if datetime.fromisoformat(submission['submitted_at'].replace('Z', '+00:00')) >= since]
+            return submissions
+        return None
+
+    def _handler(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def log_message(self, format, *args):
+                pass
+
+            def do_GET(self):
+                with server._lock:
+                    server.requests += 1
+                if server.latency:
+                    time.sleep(server.latency)
+                url = urlparse(self.path)
+                query = parse_qs(url.query)
+                data = server.route(url.path.removeprefix('/api/v1/').strip('/'), query)
+                if data is None:
+                    return self._send(404, {'errors': [{'message': 'The specified resource does not exist.'}]})
+
+                headers = {'X-Rate-Limit-Remaining': str(RATE_LIMIT_BUDGET), 'X-Request-Cost': str(REQUEST_COST)}
+                if isinstance(data, list):
+                    per_page = int(query.get('per_page', ['10'])[0])
+                    page = int(query.get('page', ['1'])[0])
+                    last = max(1, -(-len(data) // per_page))
+                    links = [('current', page), ('first', 1), ('last', last)]
+                    if page < last:
+                        links.append(('next', page + 1))
+                    headers['Link'] = ','.join(f'<{self._page_url(url, query, number)}>; rel="{rel}"'
+                                               for rel, number in links)
+                    data = data[(page - 1) * per_page:page * per_page]
+                self._send(200, data, headers)
+
+            def _page_url(self, url, query, page):
+                params = dict(query, page=[str(page)])
+                host = self.headers.get('Host')
+                return f"http://{host}{url.path}?{urlencode(params, doseq=True)}"
+
+            def _send(self, status, data, headers=None):
+                body = json.dumps(data).encode('utf-8')
+                self.send_response(status)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(body)))
+                for name, value in (headers or {}).items():
+                    self.send_header(name, value)
+                self.end_headers()
+                self.wfile.write(body)
+
+        return Handler
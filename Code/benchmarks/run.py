@@ -0,0 +1,262 @@
+# -*- coding: utf-8 -*-
+"""
+Runs the benchmark scenarios against the mock Canvas and Azure servers and
+prints the throughput, latency and peak memory of each stage:
+
+    python -m benchmarks.run --courses 2 --quizzes 4 --students 1000 --latency 0.2 --rate-limit 0.05
+
+Scenarios:
+    sync      check_new_data for every quiz, then again with nothing new to grade
+    plots     the five report figures of every quiz, first uncached then cached
+    feedback  instructor_feedback for every quiz
+
+The grade, figure and summary cache hit rates of each stage are reported too.
+
+Each scenario runs in its own process and its own temporary working directory,
+so the Data/ database and caches start empty and memory peaks don't mix.
+Embeddings use the local hashing stand-in (ALAS_EMBEDDINGS=hashing) and the
+batch mode polls the in-process MockBatchClient every second.
+"""
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+import numpy as np
+
+CODE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if CODE_DIR not in sys.path:
+    sys.path.insert(0, CODE_DIR)
+
+from benchmarks.mock_azure import MockAzure  # noqa: E402
+from benchmarks.mock_canvas import MockCanvas  # noqa: E402
+from benchmarks.synthetic import generate, graded_records, write_json  # noqa: E402
+
+SCENARIOS = ['sync', 'plots', 'feedback']
+CANVAS_KEY = 'benchmark-canvas-key'
+AZURE_KEY = 'benchmark-azure-key'
+
+
+def _peak_rss_mb():
+    """
+    Returns the peak resident set size of this process in MB, or None where resource is unavailable.
+    """
+    try:
+        import resource
+    except ImportError:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / (1 << 20) if sys.platform == 'darwin' else peak / 1024
+
+
+def measure(stage, calls, trace=True, caches=None):
+    """
+    Times a list of calls, one after the other.
+
+    Args:
+        stage (str): The name of the stage.
+        calls (list): (function, items) tuples; items is the work one call covers.
+        trace (bool): Track the peak Python heap with tracemalloc, which slows the calls down.
+        caches (dict): Caches whose hits and misses during the stage are reported, by name.
+
+    Returns:
+        result (dict): The stage's calls, items, seconds, items per second, p50 and p95
+            call latency in ms, tracemalloc peak in MB, process peak RSS in MB and
+            the hits, misses and hit rate of each cache.
+    """
+    before = {name: cache.stats() for name, cache in (caches or {}).items()}
+    if trace:
+        tracemalloc.start()
+        tracemalloc.reset_peak()
+    latencies = []
+    items = 0
+    start = time.perf_counter()
+    for function, count in calls:
+        began = time.perf_counter()
+        function()
+        latencies.append(time.perf_counter() - began)
+        items += count
+    seconds = time.perf_counter() - start
+    peak = None
+    if trace:
+        peak = tracemalloc.get_traced_memory()[1] / (1 << 20)
+        tracemalloc.stop()
+    cache_stats = {}
+    for name, cache in (caches or {}).items():
+        stats = cache.stats()
+        hits = stats['hits'] - before[name]['hits']
+        misses = stats['misses'] - before[name]['misses']
+        cache_stats[name] = {'hits': hits, 'misses': misses,
+                             'hit_rate': hits / (hits + misses) if hits + misses else None}
+    return {'stage': stage,
+            'calls': len(calls),
+            'items': items,
+            'seconds': seconds,
+            'throughput': items / seconds if seconds else None,
+            'p50_ms': float(np.percentile(latencies, 50)) * 1000 if latencies else None,
+            'p95_ms': float(np.percentile(latencies, 95)) * 1000 if latencies else None,
+            'peak_mb': peak,
+            'rss_mb': _peak_rss_mb(),
+            'caches': cache_stats}
+
+
+def worker(scenario, config):
+    """
+    Runs one scenario in the current process, which is already in its working
+    directory with the environment pointing at the mock servers.
+
+    Returns:
+        results (list): One measure() result per stage.
+    """
+    import helpers
+    from cache import FIGURE_CACHE, GRADE_CACHE, SUMMARY_CACHE
+
+    endpoint = config['endpoint']
+    trace = config['trace']
+    quizzes = [(course, quiz) for course in config['courses']
+               for quiz in helpers.get_quizzes(CANVAS_KEY, course)]
+    answers = config['students'] * config['questions']
+
+    if scenario == 'sync':
+        batch_client = None
+        if config['mode'] == 'batch':
+            from batch_grading import MockBatchClient
+            batch_client = MockBatchClient()
+
+        def sync(course, quiz):
+            return lambda: helpers.check_new_data(course, quiz, CANVAS_KEY, AZURE_KEY, endpoint,
+                                                  mode=config['mode'], batch_client=batch_client)
+
+        caches = {'grade cache': GRADE_CACHE}
+        return [measure('sync', [(sync(course, quiz), answers) for course, quiz in quizzes], trace, caches),
+                measure('sync-incremental', [(sync(course, quiz), 0) for course, quiz in quizzes], trace, caches)]
+
+    if scenario == 'plots':
+        plots = [helpers.accuracy_per_question_bar, helpers.completeness_per_question_bar,
+                 helpers.avg_of_scores_hist, helpers.accuracy, helpers.completeness]
+        calls = [((lambda plot=plot, course=course, quiz=quiz: plot(course, quiz)), 1)
+                 for course, quiz in quizzes for plot in plots]
+        caches = {'figure cache': FIGURE_CACHE}
+        return [measure('plots-cold', calls, trace, caches), measure('plots-cached', calls, trace, caches)]
+
+    if scenario == 'feedback':
+        return [measure('feedback',
+                        [((lambda course=course, quiz=quiz:
+                           helpers.instructor_feedback(course, quiz, AZURE_KEY, endpoint)), answers)
+                         for course, quiz in quizzes],
+                        trace, {'summary cache': SUMMARY_CACHE})]
+
+    raise ValueError(f"Unknown scenario {scenario}")
+
+
+def run_scenario(scenario, config, fixture, canvas, azure, env):
+    """
+    Runs a scenario in a subprocess inside a fresh working directory.
+
+    Returns:
+        results (list): The stage results, with the mock server request counts added.
+    """
+    with tempfile.TemporaryDirectory(prefix=f'alas-bench-{scenario}-') as workdir:
+        if scenario != 'sync':
+            write_json(graded_records(fixture, config['seed']), os.path.join(workdir, 'Data', 'graded_quizzes.json'))
+        canvas_before, azure_before, limited_before = canvas.requests, azure.requests, azure.rate_limited
+        process = subprocess.run([sys.executable, '-m', 'benchmarks.run', '--worker', scenario,
+                                  '--config', json.dumps(config)],
+                                 cwd=workdir, env=env, capture_output=True, text=True)
+        if process.returncode != 0:
+            print(process.stdout + process.stderr)
+            raise RuntimeError(f"The {scenario} scenario failed")
+        results = json.loads(process.stdout.strip().splitlines()[-1])
+    for result in results:
+        result['scenario'] = scenario
+    results[-1].update({'canvas_requests': canvas.requests - canvas_before,
+                        'azure_requests': azure.requests - azure_before,
+                        'azure_429s': azure.rate_limited - limited_before})
+    return results
+
+
+def print_table(results):
+    """
+    Prints the stage results as a table.
+    """
+    def number(value, digits=1):
+        return '-' if value is None else f"{value:,.{digits}f}"
+
+    header = f"{'stage':<18}{'calls':>7}{'items':>9}{'seconds':>10}{'items/s':>11}{'p50 ms':>10}{'p95 ms':>10}" \
+             f"{'heap MB':>10}{'rss MB':>9}"
+    print(header)
+    print('-' * len(header))
+    for result in results:
+        print(f"{result['stage']:<18}{result['calls']:>7}{result['items']:>9}{number(result['seconds'], 2):>10}"
+              f"{number(result['throughput']):>11}{number(result['p50_ms']):>10}{number(result['p95_ms']):>10}"
+              f"{number(result['peak_mb']):>10}{number(result['rss_mb']):>9}")
+        for name, stats in result.get('caches', {}).items():
+            rate = '-' if stats['hit_rate'] is None else f"{stats['hit_rate']:.0%}"
+            print(f"{'':<18}{name.capitalize()}: {stats['hits']} hits, {stats['misses']} misses ({rate} hit rate)")
+        if 'canvas_requests' in result:
+            print(f"{'':<18}Canvas requests {result['canvas_requests']}, Azure requests "
+                  f"{result['azure_requests']} ({result['azure_429s']} rate limited)")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark syncing, plotting and feedback against local mocks.")
+    parser.add_argument('--scenarios', nargs='*', choices=SCENARIOS, default=SCENARIOS)
+    parser.add_argument('--courses', type=int, default=1)
+    parser.add_argument('--quizzes', type=int, default=2, help="Quizzes per course.")
+    parser.add_argument('--students', type=int, default=200, help="Students per course.")
+    parser.add_argument('--questions', type=int, default=3, help="Essay questions per quiz.")
+    parser.add_argument('--scale', type=float, default=1.0, help="Multiplies the number of students.")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--mode', choices=['sync', 'grouped', 'batch'], default='sync',
+                        help="Grading mode of the sync scenario.")
+    parser.add_argument('--latency', type=float, default=0.05, help="Seconds per Azure completion.")
+    parser.add_argument('--jitter', type=float, default=0.0, help="Extra random seconds per Azure completion.")
+    parser.add_argument('--rate-limit', type=float, default=0.0, help="Share of Azure requests refused with a 429.")
+    parser.add_argument('--retry-after', type=float, default=0.1, help="Seconds sent in the retry-after header.")
+    parser.add_argument('--canvas-latency', type=float, default=0.0, help="Seconds per Canvas request.")
+    parser.add_argument('--no-tracemalloc', action='store_true',
+                        help="Skip the heap peak measurement, which slows Python code down.")
+    parser.add_argument('--json', help="Also write the results to this file.")
+    parser.add_argument('--worker', help=argparse.SUPPRESS)
+    parser.add_argument('--config', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.worker:
+        print(json.dumps(worker(args.worker, json.loads(args.config))))
+        return
+
+    students = max(1, round(args.students * args.scale))
+    fixture = generate(args.courses, args.quizzes, students, args.questions, args.seed)
+    print(f"{args.courses} courses x {args.quizzes} quizzes x {students} students x {args.questions} questions "
+          f"= {args.courses * args.quizzes * students * args.questions:,} answers")
+
+    with MockCanvas(fixture, args.canvas_latency) as canvas, \
+            MockAzure(args.latency, args.jitter, args.rate_limit, args.retry_after, args.seed) as azure:
+        config = {'courses': [str(course['id']) for course in fixture['courses']],
+                  'students': students,
+                  'questions': args.questions,
+                  'seed': args.seed,
+                  'mode': args.mode,
+                  'endpoint': azure.endpoint,
+                  'trace': not args.no_tracemalloc}
+        env = dict(os.environ,
+                   PYTHONPATH=os.pathsep.join(filter(None, [CODE_DIR, os.environ.get('PYTHONPATH')])),
+                   ALAS_CANVAS_BASE_URL=canvas.base_url,
+                   ALAS_EMBEDDINGS='hashing',
+                   ALAS_BATCH_POLL_SECONDS=os.environ.get('ALAS_BATCH_POLL_SECONDS', '1'))
+        results = []
+        for scenario in args.scenarios:
+            results.extend(run_scenario(scenario, config, fixture, canvas, azure, env))
+
+    print_table(results)
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
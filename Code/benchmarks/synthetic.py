@@ -0,0 +1,169 @@
+# -*- coding: utf-8 -*-
+"""
+Synthetic Consolidation quizzes, as Canvas API objects and as graded records.
+
+    python -m benchmarks.synthetic --courses 2 --quizzes 6 --students 500 --out Data/graded_quizzes.json
+"""
+
+import argparse
+import json
+import os
+import random
+from datetime import datetime, timedelta, timezone
+from storage import COLUMNS
+
+TOPICS = ['glycolysis', 'the cardiac cycle', 'renal clearance', 'action potentials', 'antibody class switching',
+          'the coagulation cascade', 'surfactant', 'insulin signalling', 'the Frank-Starling law', 'bile acids']
+PHRASES = ['increases', 'decreases', 'depends on', 'is regulated by', 'is independent of', 'limits', 'drives']
+TERMS = ['ATP', 'calcium', 'preload', 'GFR', 'sodium channels', 'IgG', 'thrombin', 'compliance', 'GLUT4',
+         'micelles', 'afterload', 'potassium', 'cortisol', 'pH', 'oxygen delivery']
+FILLERS = ['', 'see above', 'I am not sure.', 'Same as the previous question.']
+
+
+def _sentence(rng):
+    return f"{rng.choice(TERMS)} {rng.choice(PHRASES)} {rng.choice(TERMS)}."
+
+
+def answer_text(rng, words=60):
+    """
+    Returns a random student answer: a few short sentences, sometimes a filler
+    such as a blank or "see above", and sometimes a copy of a common answer.
+    """
+    roll = rng.random()
+    if roll < 0.05:
+        return rng.choice(FILLERS)
+    if roll < 0.15:
+        return "Because " + ' '.join(_sentence(random.Random(rng.randint(0, 3))) for _ in range(3))
+    return ' '.join(_sentence(rng) for _ in range(max(1, words // 4)))
+
+
+def generate(courses=2, quizzes=4, students=100, questions=3, seed=0, first_course=100000):
+    """
+    Builds the Canvas objects of a synthetic set of Consolidation quizzes.
+
+    Args:
+        courses (int): The number of courses.
+        quizzes (int): The number of quizzes per course.
+        students (int): The number of students per course.
+        questions (int): The number of essay questions per quiz.
+        seed (int): The random seed.
+        first_course (int): The ID of the first course.
+
+    Returns:
+        fixture (dict): courses (list), quizzes (lists keyed by course ID), questions
+            (lists keyed by quiz ID) and submissions (lists keyed by assignment ID).
+    """
+    rng = random.Random(seed)
+    start = datetime(2024, 8, 6, tzinfo=timezone.utc)
+    fixture = {'courses': [], 'quizzes': {}, 'questions': {}, 'submissions': {}}
+    quiz_id = assignment_id = question_id = submission_id = 0
+    for c in range(courses):
+        course_id = first_course + c
+        fixture['courses'].append({'id': course_id, 'name': f"Pathways Course {c + 1}"})
+        fixture['quizzes'][course_id] = []
+        for q in range(quizzes):
+            quiz_id += 1
+            assignment_id += 1
+            topic = TOPICS[q % len(TOPICS)]
+            fixture['quizzes'][course_id].append({
+                'id': quiz_id,
+                'assignment_id': assignment_id,
+                'title': f"Pathways {q + 1} Consolidation",
+                'quiz_type': 'assignment',
+                'question_count': questions,
+                'points_possible': float(questions),
+                'html_url': f"https://canvas.harvard.edu/courses/{course_id}/quizzes/{quiz_id}"})
+            fixture['questions'][quiz_id] = []
+            for n in range(questions):
+                question_id += 1
+                fixture['questions'][quiz_id].append({
+                    'id': question_id,
+                    'quiz_id': quiz_id,
+                    'question_type': 'essay_question',
+                    'question_name': f"Question {n + 1}",
+                    'question_text': f"<p>Explain how {topic} relates to {rng.choice(TERMS)} ({n + 1}).</p>",
+                    'neutral_comments': ' '.join(_sentence(rng) for _ in range(4))})
+            fixture['submissions'][assignment_id] = []
+            for s in range(students):
+                submission_id += 1
+                submitted_at = start + timedelta(days=7 * q, minutes=rng.randint(0, 7 * 24 * 60))
+                fixture['submissions'][assignment_id].append({
+                    'id': submission_id,
+                    'user_id': course_id * 100000 + s,
+                    'score': float(rng.randint(0, questions)),
+                    'attempt': 1,
+                    'submitted_at': submitted_at.isoformat().replace('+00:00', 'Z'),
+                    'submission_history': [{'submission_data': [
+                        {'question_id': question['id'], 'points': 0.0, 'text': answer_text(rng)}
+                        for question in fixture['questions'][quiz_id]]}]})
+    return fixture
+
+
+def graded_records(fixture, seed=0):
+    """
+    Returns the fixture's answers as graded records keyed by COLUMNS, with random grades.
+
+    Args:
+        fixture (dict): The output of generate().
+        seed (int): The random seed of the grades.
+
+    Returns:
+        records (list): One dictionary per answer.
+    """
+    rng = random.Random(seed)
+    records = []
+    for course_id, quizzes in fixture['quizzes'].items():
+        for quiz in quizzes:
+            questions = {question['id']: question for question in fixture['questions'][quiz['id']]}
+            for submission in fixture['submissions'][quiz['assignment_id']]:
+                for data in submission['submission_history'][0]['submission_data']:
+                    question = questions[data['question_id']]
+                    accuracy = rng.choice([1, 2, 2, 3, 3, 3, 4, 4])
+                    record = {'quiz_id': quiz['id'],
+                              'quiz_type': quiz['quiz_type'],
+                              'quiz_title': quiz['title'],
+                              'history_id': question['id'],
+                              'submission_id': submission['id'],
+                              'student_score': submission['score'],
+                              'quiz_question_count': quiz['question_count'],
+                              'quiz_points_possible': quiz['points_possible'],
+                              'question_points_possible': quiz['points_possible'],
+                              'answer_points_scored': data['points'],
+                              'attempt': submission['attempt'],
+                              'question_name': question['question_name'],
+                              'question_type': question['question_type'],
+                              'question_text': question['question_text'],
+                              'question_answer': question['neutral_comments'],
+                              'student_answer': data['text'],
+                              'course_id': course_id,
+                              'accuracy': accuracy,
+                              'completeness': max(1, min(4, accuracy + rng.choice([-1, 0, 0, 1]))),
+                              'propagated_from': None}
+                    records.append({column: record[column] for column in COLUMNS})
+    return records
+
+
+def write_json(records, path):
+    """
+    Writes records in the format of the legacy graded_quizzes.json file.
+    """
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump(records, f)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Write a synthetic graded_quizzes.json.")
+    parser.add_argument('--courses', type=int, default=2)
+    parser.add_argument('--quizzes', type=int, default=4, help="Quizzes per course.")
+    parser.add_argument('--students', type=int, default=100, help="Students per course.")
+    parser.add_argument('--questions', type=int, default=3, help="Essay questions per quiz.")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--out', default='Data/graded_quizzes.json')
+    args = parser.parse_args()
+    records = graded_records(generate(args.courses, args.quizzes, args.students, args.questions, args.seed),
+                             args.seed)
+    write_json(records, args.out)
+    print(f"Wrote {len(records)} graded answers to {args.out}")
@@ -0,0 +1,233 @@
+# -*- coding: utf-8 -*-
+"""Persistent content-addressed cache for LLM results, and an in-memory cache for figures."""
+
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+import unicodedata
+from collections import OrderedDict
+
+CACHE_DIR = 'Data/cache'
+
+
+def content_hash(*parts):
+    """
+    Returns a stable SHA-256 hex digest of the given parts.
+
+    Args:
+        *parts: JSON-serializable values that identify the cached content.
+
+    Returns:
+        digest (str): The hex digest of the parts.
+    """
+    payload = json.dumps(parts, ensure_ascii=False, sort_keys=True, default=str)
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+
+def normalize_text(text):
+    """
+    Normalizes free text so trivially different copies of an answer hash the same.
+
+    Args:
+        text (str): The text to normalize.
+
+    Returns:
+        normalized (str): The text with unicode normalized and whitespace collapsed.
+    """
+    if text is None:
+        return ''
+    return ' '.join(unicodedata.normalize('NFKC', str(text)).split())
+
+
+class DiskCache:
+    """
+    A SQLite-backed key/value cache with size and age eviction and hit/miss counters.
+
+    Values are stored as JSON. Entries older than max_age seconds are treated as
+    misses, and once the cache holds more than max_entries the least recently
+    used entries are evicted. Eviction runs every evict_every writes to keep set() cheap.
+    """
+
+    evict_every = 100
+
+    def __init__(self, name, max_entries=100000, max_age=None, directory=CACHE_DIR):
+        self.path = os.path.join(directory, f'{name}.sqlite')
+        self.max_entries = max_entries
+        self.max_age = max_age
+        self.hits = 0
+        self.misses = 0
+        self._writes = 0
+        self._lock = threading.Lock()
+        self._conn = None
+
+    def _connect(self):
+        """
+        Opens the cache database on first use.
+        """
+        if self._conn is None:
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            self._conn = sqlite3.connect(self.path, check_same_thread=False, timeout=30)
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute("CREATE TABLE IF NOT EXISTS cache ("
+                               "key TEXT PRIMARY KEY, value TEXT NOT NULL, "
+                               "created REAL NOT NULL, accessed REAL NOT NULL)")
+            self._conn.execute("CREATE INDEX IF NOT EXISTS ix_cache_accessed ON cache (accessed)")
+        return self._conn
+
+    def get(self, key):
+        """
+        Looks up a cached value.
+
+        Args:
+            key (str): The cache key.
+
+        Returns:
+            value: The cached value, or None on a miss.
+        """
+        now = time.time()
+        with self._lock:
+            conn = self._connect()
+            row = conn.execute("SELECT value, created FROM cache WHERE key = ?", (key,)).fetchone()
+            if row is None or (self.max_age is not None and now - row[1] > self.max_age):
+                self.misses += 1
+                return None
+            conn.execute("UPDATE cache SET accessed = ? WHERE key = ?", (now, key))
+            conn.commit()
+            self.hits += 1
+            return json.loads(row[0])
+
+    def set(self, key, value):
+        """
+        Stores a value and evicts expired or least recently used entries.
+
+        Args:
+            key (str): The cache key.
+            value: A JSON-serializable value.
+        """
+        now = time.time()
+        with self._lock:
+            conn = self._connect()
+            conn.execute("INSERT OR REPLACE INTO cache (key, value, created, accessed) "
+                         "VALUES (?, ?, ?, ?)", (key, json.dumps(value), now, now))
+            self._writes += 1
+            if self._writes % self.evict_every == 0:
+                self._evict(conn, now)
+            conn.commit()
+
+    def _evict(self, conn, now):
+        """
+        Removes expired entries and trims the cache to max_entries.
+        """
+        if self.max_age is not None:
+            conn.execute("DELETE FROM cache WHERE created < ?", (now - self.max_age,))
+        if self.max_entries is not None:
+            count = conn.execute("SELECT COUNT(*) FROM cache").fetchone()[0]
+            if count > self.max_entries:
+                conn.execute("DELETE FROM cache WHERE key IN "
+                             "(SELECT key FROM cache ORDER BY accessed LIMIT ?)",
+                             (count - self.max_entries,))
+
+    def stats(self):
+        """
+        Returns the hit/miss counters of the cache.
+
+        Returns:
+            stats (dict): hits, misses, hit_rate and the number of stored entries.
+        """
+        with self._lock:
+            entries = self._connect().execute("SELECT COUNT(*) FROM cache").fetchone()[0]
+            lookups = self.hits + self.misses
+            return {'hits': self.hits,
+                    'misses': self.misses,
+                    'hit_rate': self.hits / lookups if lookups else 0.0,
+                    'entries': entries}
+
+
+class FigureCache:
+    """
+    An in-memory LRU cache of plotly figures, bounded by total size.
+
+    Figures are stored and returned as is, since copying a figure costs as much
+    as building a small one; they are shared and must not be modified in place.
+    Each figure is counted at the size of its JSON, and the least recently used
+    ones are dropped once the total exceeds max_bytes. Keys should include the
+    version of the data the figure was built from, so a figure is never served
+    after that data changed.
+    """
+
+    def __init__(self, max_bytes=64 * 1024 * 1024):
+        self.max_bytes = max_bytes
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()  # key -> (figure, size)
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        """
+        Looks up a cached figure.
+
+        Args:
+            key (tuple): The cache key.
+
+        Returns:
+            figure (Figure): The shared cached figure, or None on a miss.
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+    def set(self, key, value, size):
+        """
+        Stores a figure and evicts the least recently used ones over max_bytes.
+
+        Args:
+            key (tuple): The cache key.
+            value (Figure): The figure.
+            size (int): The size counted for the figure, e.g. the length of its JSON.
+        """
+        with self._lock:
+            previous = self._entries.pop(key, None)
+            if previous is not None:
+                self.size -= previous[1]
+            if size > self.max_bytes:
+                return
+            self._entries[key] = (value, size)
+            self.size += size
+            while self.size > self.max_bytes:
+                _, (evicted, evicted_size) = self._entries.popitem(last=False)
+                self.size -= evicted_size
+
+    def stats(self):
+        """
+        Returns the hit/miss counters of the cache.
+
+        Returns:
+            stats (dict): hits, misses, hit_rate, the number of entries and their total size in bytes.
+        """
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {'hits': self.hits,
+                    'misses': self.misses,
+                    'hit_rate': self.hits / lookups if lookups else 0.0,
+                    'entries': len(self._entries),
+                    'bytes': self.size}
+
+
+GRADE_CACHE = DiskCache('grades',
+                        max_entries=int(os.environ.get('ALAS_GRADE_CACHE_MAX_ENTRIES', '200000')),
+                        max_age=float(os.environ.get('ALAS_GRADE_CACHE_MAX_AGE_DAYS', '365')) * 86400)
+
+SUMMARY_CACHE = DiskCache('summaries',
+                          max_entries=int(os.environ.get('ALAS_SUMMARY_CACHE_MAX_ENTRIES', '50000')),
+                          max_age=float(os.environ.get('ALAS_SUMMARY_CACHE_MAX_AGE_DAYS', '365')) * 86400)
+
+FIGURE_CACHE = FigureCache(max_bytes=int(os.environ.get('ALAS_FIGURE_CACHE_MAX_MB', '64')) * 1024 * 1024)
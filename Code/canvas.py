@@ -0,0 +1,273 @@
+# -*- coding: utf-8 -*-
+"""Pooled Canvas API client shared by the helpers that talk to Canvas."""
+
+import json
+import os
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+from urllib.parse import parse_qs, urlparse
+import requests
+from requests.adapters import HTTPAdapter
+
+BASE_URL = os.environ.get('ALAS_CANVAS_BASE_URL', "https://canvas.harvard.edu/api/v1/")
+PAGE_CONCURRENCY = int(os.environ.get('ALAS_CANVAS_PAGE_CONCURRENCY', '4'))
+TIMEOUT = 15
+MAX_RETRIES = int(os.environ.get('ALAS_CANVAS_MAX_RETRIES', '5'))
+BASE_BACKOFF = 1.0
+MAX_BACKOFF = 30.0
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+
+class Throttle:
+    """
+    Paces requests from Canvas's X-Rate-Limit-Remaining and X-Request-Cost headers.
+
+    Canvas throttles each token with a leaky bucket; the remaining quota and the
+    cost of the last request come back on every response. While the quota is
+    above `threshold` (after another request of the last cost) requests are sent
+    immediately. Below it, each request waits in proportion to how far the
+    quota has drained, up to `max_pace` seconds, which lets the bucket refill
+    instead of hitting a 403.
+    """
+
+    def __init__(self, threshold=300.0, max_pace=2.0):
+        self.threshold = threshold
+        self.max_pace = max_pace
+        self.remaining = None
+        self.cost = 0.0
+        self._lock = threading.Lock()
+
+    def delay(self):
+        """
+        Returns how long the next request should wait, in seconds.
+        """
+        with self._lock:
+            if self.remaining is None:
+                return 0.0
+            # Quota left after another request as expensive as the last one
+            headroom = max(self.remaining - self.cost, 0.0)
+            if headroom >= self.threshold:
+                return 0.0
+            return (self.threshold - headroom) / self.threshold * self.max_pace
+
+    def wait(self):
+        """
+        Sleeps for the current pacing delay.
+        """
+        delay = self.delay()
+        if delay > 0:
+            time.sleep(delay)
+
+    def update(self, headers):
+        """
+        Records the quota reported by a Canvas response.
+
+        Args:
+            headers (dict): The response headers.
+        """
+        with self._lock:
+            try:
+                self.remaining = float(headers['X-Rate-Limit-Remaining'])
+            except (KeyError, TypeError, ValueError):
+                pass
+            try:
+                self.cost = float(headers['X-Request-Cost'])
+            except (KeyError, TypeError, ValueError):
+                pass
+
+
+def backoff(attempt, retry_after=None):
+    """
+    Returns the delay before retry number attempt: Retry-After if given, otherwise
+    bounded exponential backoff with full jitter.
+
+    Args:
+        attempt (int): The number of retries made so far.
+        retry_after (str): The Retry-After header of the failed response.
+
+    Returns:
+        delay (float): The number of seconds to sleep.
+    """
+    try:
+        return min(float(retry_after), MAX_BACKOFF)
+    except (TypeError, ValueError):
+        return random.uniform(0, min(MAX_BACKOFF, BASE_BACKOFF * 2 ** attempt))
+
+
+def _should_retry(response):
+    """
+    Returns True for responses that signal throttling or a transient server error.
+    """
+    if response.status_code in RETRY_STATUSES:
+        return True
+    return response.status_code == 403 and 'Rate Limit Exceeded' in response.text
+
+
+class CanvasClient:
+    """
+    A Canvas API client with a pooled keep-alive session.
+
+    Listings are paginated by following the Link header, and when Canvas exposes
+    a numbered `last` page the remaining pages are fetched in parallel.
+    Conditional requests reuse the ETag of the previous response, so an
+    unchanged listing comes back as a 304 and is served from memory.
+    Requests are paced by a Throttle, and throttled or failed requests are
+    retried with backoff at most max_retries times before the error is raised.
+    """
+
+    def __init__(self, api_key, base_url=BASE_URL, page_concurrency=PAGE_CONCURRENCY,
+                 max_retries=MAX_RETRIES):
+        self.base_url = base_url
+        self.page_concurrency = max(1, int(page_concurrency))
+        self.max_retries = max_retries
+        self.throttle = Throttle()
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=self.page_concurrency * 2)
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+        self.session.headers.update({"Authorization": f"Bearer {api_key}"})
+        self._etags = {}
+        self._lock = threading.Lock()
+
+    def _url(self, path):
+        """
+        Resolves a path relative to the API base URL; absolute URLs are returned as is.
+        """
+        if path.startswith('http://') or path.startswith('https://'):
+            return path
+        return self.base_url + path.lstrip('/')
+
+    def request(self, path, params=None, conditional=False):
+        """
+        Sends a GET request to the Canvas API.
+
+        Args:
+            path (str): The API path (relative to the base URL) or an absolute URL.
+            params (dict): The query parameters.
+            conditional (bool): Send If-None-Match with the ETag of the last response.
+
+        Returns:
+            data: The decoded JSON body.
+            links (dict): The parsed Link header of the response.
+        """
+        url = self._url(path)
+        key = (url, tuple(sorted((params or {}).items())))
+        headers = {}
+        cached = None
+        if conditional:
+            with self._lock:
+                cached = self._etags.get(key)
+            if cached:
+                headers['If-None-Match'] = cached[0]
+
+        response = self._send(url, params, headers)
+        if response.status_code == 304 and cached:
+            return cached[1], cached[2]
+        response.raise_for_status()  # Raise an exception for 4xx/5xx status codes
+        data = json.loads(response.text)  # Convert response text to dict
+
+        etag = response.headers.get('ETag')
+        if conditional and etag:
+            with self._lock:
+                self._etags[key] = (etag, data, response.links)
+        return data, response.links
+
+    def _send(self, url, params, headers):
+        """
+        Sends a paced GET request, retrying throttled and transient failures.
+
+        Returns:
+            response (Response): The last response received.
+        """
+        attempt = 0
+        while True:
+            self.throttle.wait()
+            try:
+                response = self.session.get(url, params=params, headers=headers, timeout=TIMEOUT)
+            except (requests.exceptions.ConnectionError, requests.exceptions.Timeout) as e:
+                if attempt >= self.max_retries:
+                    raise
+                print(f"Canvas request failed ({e}), retrying")
+                time.sleep(backoff(attempt))
+                attempt += 1
+                continue
+
+            self.throttle.update(response.headers)
+            if not _should_retry(response) or attempt >= self.max_retries:
+                return response
+            time.sleep(backoff(attempt, response.headers.get('Retry-After')))
+            attempt += 1
+
+    def get(self, path, params=None, conditional=False):
+        """
+        Returns the decoded JSON body of a single Canvas API request.
+
+        Args:
+            path (str): The API path (relative to the base URL) or an absolute URL.
+            params (dict): The query parameters.
+            conditional (bool): Send If-None-Match with the ETag of the last response.
+
+        Returns:
+            data: The decoded JSON body.
+        """
+        return self.request(path, params, conditional)[0]
+
+    def paginate(self, path, params=None, conditional=False):
+        """
+        Yields every page of a Canvas listing, in order.
+
+        Args:
+            path (str): The API path of the listing.
+            params (dict): The query parameters of the first page.
+            conditional (bool): Send If-None-Match with the ETag of the last response.
+
+        Yields:
+            page (list): The items of each page.
+        """
+        params = dict(params or {})
+        params.setdefault('per_page', 100)
+        data, links = self.request(path, params, conditional)
+        yield data
+
+        last_page = _page_number(links.get('last', {}).get('url'))
+        if last_page is not None and self.page_concurrency > 1:
+            def fetch(page):
+                return self.get(path, dict(params, page=page), conditional)
+
+            with ThreadPoolExecutor(max_workers=self.page_concurrency) as executor:
+                yield from executor.map(fetch, range(2, last_page + 1))
+            return
+
+        while "next" in links:
+            data, links = self.request(links['next']['url'], conditional=conditional)
+            yield data
+
+
+def _page_number(url):
+    """
+    Returns the numeric page parameter of a Link header URL, or None for bookmarks.
+    """
+    if not url:
+        return None
+    page = parse_qs(urlparse(url).query).get('page', [None])[0]
+    try:
+        return int(page)
+    except (TypeError, ValueError):
+        return None
+
+
+@lru_cache(maxsize=32)
+def get_client(api_key):
+    """
+    Returns the shared Canvas client for an API key.
+
+    Args:
+        api_key (str): The Canvas API key.
+
+    Returns:
+        client (CanvasClient): The pooled client for the key.
+    """
+    return CanvasClient(api_key)
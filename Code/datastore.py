@@ -0,0 +1,195 @@
+# -*- coding: utf-8 -*-
+"""Shared in-process store for the graded quiz dataset used by helpers.py and app.py."""
+
+import threading
+import storage
+
+
+class DatasetStore:
+    """
+    Serves graded answers from the SQLite backend to every plot and table.
+
+    Per-quiz frames are read with an indexed query and kept in memory until the
+    database version changes (another session appended rows) or invalidate()
+    is called (check_new_data does so after appending). On first use the
+    legacy JSON file is imported if the database is empty.
+    Frames returned by the store are shared and must not be modified in place.
+    """
+
+    def __init__(self, db_path=storage.DB_PATH, json_path=storage.JSON_PATH):
+        self.db_path = db_path
+        self.json_path = json_path
+        self._lock = threading.RLock()
+        self._engine = None
+        self._signature = None
+        self._stale = True
+        self._quiz_frames = {}
+        self._group_means = {}
+        self._score_counts = {}
+
+    @property
+    def engine(self):
+        """
+        The database engine, created (and the legacy JSON imported) on first access.
+        """
+        with self._lock:
+            if self._engine is None:
+                self._engine = storage.get_engine(self.db_path)
+                storage.import_json(self.json_path, self._engine)
+            return self._engine
+
+    def _refresh(self):
+        """
+        Drops the cached frames if the database changed since they were read.
+        """
+        signature = storage.data_version(self.engine)
+        if self._stale or signature != self._signature:
+            self._quiz_frames = {}
+            self._group_means = {}
+            self._score_counts = {}
+            self._signature = signature
+            self._stale = False
+
+    def invalidate(self):
+        """
+        Forces the next read to query the database again.
+        """
+        with self._lock:
+            self._stale = True
+
+    def append(self, records):
+        """
+        Appends graded answers to the database and invalidates the cached frames.
+
+        Args:
+            records (list): A list of graded answer dictionaries keyed by COLUMNS.
+
+        Returns:
+            inserted (int): The number of new rows written.
+        """
+        inserted = storage.append_records(records, self.engine)
+        self.invalidate()
+        return inserted
+
+    def quiz_frame(self, course, quiz):
+        """
+        Returns the graded answers for a single course and quiz.
+
+        Args:
+            course (str): The course ID.
+            quiz (str): The quiz ID.
+
+        Returns:
+            subset (DataFrame): The rows for the given course and quiz.
+        """
+        key = (int(course), int(quiz))
+        with self._lock:
+            self._refresh()
+            if key not in self._quiz_frames:
+                self._quiz_frames[key] = storage.read_quiz(course, quiz, self.engine)
+            return self._quiz_frames[key]
+
+    def score_counts(self, course, quiz):
+        """
+        Returns the score histogram of every question of a course and quiz.
+
+        Args:
+            course (str): The course ID.
+            quiz (str): The quiz ID.
+
+        Returns:
+            counts (DataFrame): question_name, metric, score and count.
+        """
+        key = (int(course), int(quiz))
+        with self._lock:
+            self._refresh()
+            if key not in self._score_counts:
+                self._score_counts[key] = storage.read_score_counts(course, quiz, self.engine)
+            return self._score_counts[key]
+
+    def course_quizzes(self, course):
+        """
+        Returns the titles of the quizzes of a course that have graded answers, keyed by quiz ID.
+        """
+        return storage.read_course_quizzes(course, self.engine)
+
+    def iter_answers(self, course, quizzes=None, chunk_size=5000):
+        """
+        Streams the graded answers of a course, or of some of its quizzes, in chunks
+        (see storage.iter_answers).
+        """
+        return storage.iter_answers(course, quizzes, chunk_size, self.engine)
+
+    def quiz_version(self, course, quiz):
+        """
+        Returns a value that changes whenever graded answers of the quiz are appended.
+        """
+        return storage.quiz_version(course, quiz, self.engine)
+
+    def group_version(self, quiz_group):
+        """
+        Returns a value that changes whenever graded answers of a quiz in the group are appended.
+        """
+        return storage.group_version(quiz_group, self.engine)
+
+    def quiz_title(self, course, quiz):
+        """
+        Returns the title of a quiz, or None if none of its answers is stored.
+        """
+        return storage.read_quiz_title(course, quiz, self.engine)
+
+    def page(self, course, quiz, columns=None, offset=0, limit=50, filters=None, search=None, truncate=None):
+        """
+        Returns one filtered page of the graded answers of a quiz and the number
+        of matching rows (see storage.read_page).
+        """
+        return storage.read_page(course, quiz, columns, offset, limit, filters, search, truncate, self.engine)
+
+    def answer(self, answer_id):
+        """
+        Returns every column of a single graded answer, or None if there is no such row.
+        """
+        return storage.read_answer(answer_id, self.engine)
+
+    def graded_keys(self, course, quiz):
+        """
+        Returns the keys of every answer already graded for a course and quiz.
+
+        Args:
+            course (str): The course ID.
+            quiz (str): The quiz ID.
+
+        Returns:
+            keys (set): A set of (submission_id, question_id, attempt) tuples.
+        """
+        return storage.graded_keys(course, quiz, self.engine)
+
+    def watermark(self, course, quiz):
+        """
+        Returns the latest Canvas submitted_at already synced for a course and quiz, or None.
+        """
+        return storage.get_watermark(course, quiz, self.engine)
+
+    def set_watermark(self, course, quiz, submitted_at):
+        """
+        Stores the latest Canvas submitted_at fully synced for a course and quiz.
+        """
+        storage.set_watermark(course, quiz, submitted_at, self.engine)
+
+    def group_means(self, quiz_group):
+        """
+        Returns the mean scores of every quiz in a quiz group.
+
+        Args:
+            quiz_group (str): The first word of the quiz titles.
+
+        Returns:
+            means (DataFrame): quiz_title, quiz_num and one column per metric, ordered by quiz_num.
+        """
+        with self._lock:
+            self._refresh()
+            if quiz_group not in self._group_means:
+                self._group_means[quiz_group] = storage.read_group_means(quiz_group, self.engine)
+            return self._group_means[quiz_group]
+
+DATASET = DatasetStore()
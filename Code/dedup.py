@@ -0,0 +1,128 @@
+# -*- coding: utf-8 -*-
+"""Near-duplicate answer detection, so equivalent answers to a question are graded once."""
+
+import hashlib
+import os
+import re
+import numpy as np
+from cache import normalize_text
+
+DEDUP = os.environ.get('ALAS_DEDUP', 'exact')  # 'exact', 'near' or 'off'
+DEDUP_THRESHOLD = float(os.environ.get('ALAS_DEDUP_THRESHOLD', '0.98'))  # Estimated Jaccard similarity, 'near' only
+SHINGLE_WORDS = 3
+NUM_PERM = 128
+BANDS = 16  # 8 rows per band: pairs above ~0.7 similarity become candidates
+
+# Permutations h(x) = ((a * x + b) mod p) mod 2**32, with the multiplication wrapping at 2**64
+_PRIME = np.uint64((1 << 61) - 1)
+_MASK = np.uint64(0xFFFFFFFF)
+_rng = np.random.RandomState(20240806)
+_A = _rng.randint(1, (1 << 61) - 1, NUM_PERM, dtype=np.uint64)
+_B = _rng.randint(0, (1 << 61) - 1, NUM_PERM, dtype=np.uint64)
+
+
+def canonical_text(text):
+    """
+    Normalizes an answer for duplicate detection: unicode and whitespace are
+    normalized, case is folded and trailing sentence punctuation is dropped.
+    Other symbols are kept, since "Na+" and "Na-", "↑" and "↓" or ">" and "<"
+    can flip the meaning of an answer.
+
+    Args:
+        text (str): The answer.
+
+    Returns:
+        canonical (str): The normalized answer.
+    """
+    return re.sub(r'[\s.!?]+$', '', normalize_text(text).casefold())
+
+
+def shingles(text, size=SHINGLE_WORDS):
+    """
+    Returns the 32-bit hashes of the overlapping word shingles of a text. Word
+    shingles keep a one-word edit from looking like a near copy: changing one
+    word changes `size` shingles, where character shingles would barely move.
+    """
+    words = text.split()
+    if len(words) <= size:
+        pieces = {' '.join(words)}
+    else:
+        pieces = {' '.join(words[i:i + size]) for i in range(len(words) - size + 1)}
+    return np.array([int.from_bytes(hashlib.blake2b(piece.encode('utf-8'), digest_size=4).digest(), 'little')
+                     for piece in pieces], dtype=np.uint64)
+
+
+def minhash(text):
+    """
+    Returns the MinHash signature of a canonical text.
+
+    Args:
+        text (str): The canonical answer.
+
+    Returns:
+        signature (ndarray): NUM_PERM minimum hash values.
+    """
+    hashes = shingles(text)
+    return (((np.outer(hashes, _A) + _B) % _PRIME) & _MASK).min(axis=0)
+
+
+class DuplicateIndex:
+    """
+    Finds answers that duplicate an earlier answer to the same question.
+
+    Answers with the same canonical text are exact duplicates. With near set
+    (ALAS_DEDUP=near), other answers are also matched with MinHash
+    locality-sensitive hashing: signatures are split into BANDS bands, answers
+    sharing a band become candidates, and a candidate is a duplicate when the
+    estimated Jaccard similarity of their word shingles is at least threshold.
+    Near matching is opt-in because answers differing in one word ("increases"
+    or "decreases") can deserve opposite grades. Answers are added one at a
+    time, so the index can sit between fetching and grading.
+    """
+
+    def __init__(self, threshold=DEDUP_THRESHOLD, near=DEDUP == 'near'):
+        self.threshold = threshold
+        self.near = near
+        self._exact = {}
+        self._bands = {}
+        self._signatures = []
+        self._items = []
+
+    def find_or_add(self, text, item):
+        """
+        Returns the item of an earlier duplicate of text, or adds text as a new
+        representative and returns None.
+
+        Args:
+            text (str): The answer.
+            item: The value returned for later duplicates of this answer.
+
+        Returns:
+            representative: The item of the matching earlier answer, or None.
+        """
+        canonical = canonical_text(text)
+        if canonical in self._exact:
+            return self._exact[canonical]
+
+        if self.near and canonical:
+            signature = minhash(canonical)
+            rows = NUM_PERM // BANDS
+            keys = [(band, signature[band * rows:(band + 1) * rows].tobytes()) for band in range(BANDS)]
+            candidates = {candidate for key in keys for candidate in self._bands.get(key, ())}
+            best, best_similarity = None, self.threshold
+            for candidate in sorted(candidates):
+                similarity = float(np.mean(self._signatures[candidate] == signature))
+                if similarity >= best_similarity:
+                    best, best_similarity = candidate, similarity
+            if best is not None:
+                return self._items[best]
+
+            position = len(self._items)
+            self._signatures.append(signature)
+            self._items.append(item)
+            for key in keys:
+                self._bands.setdefault(key, []).append(position)
+
+        self._exact[canonical] = item
+        return None
+
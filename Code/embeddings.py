@@ -0,0 +1,300 @@
+# -*- coding: utf-8 -*-
+"""Answer embeddings, cached in a memory-mapped matrix, and clustering of score buckets."""
+
+import hashlib
+import os
+import re
+import sqlite3
+import threading
+from functools import lru_cache
+import numpy as np
+from cache import CACHE_DIR, content_hash, normalize_text
+
+EMBEDDINGS = os.environ.get('ALAS_EMBEDDINGS', 'azure')  # 'azure', 'hashing' or 'off'
+EMBEDDING_DEPLOYMENT = os.environ.get('ALAS_EMBEDDING_DEPLOYMENT', 'text-embedding-3-small')
+EMBEDDING_API_VERSION = "2024-02-01"
+EMBEDDING_BATCH = 64
+HASHING_DIM = 256
+CLUSTER_MIN_ANSWERS = int(os.environ.get('ALAS_CLUSTER_MIN_ANSWERS', '12'))  # Smaller buckets are sent whole
+MAX_CLUSTERS = int(os.environ.get('ALAS_MAX_CLUSTERS', '8'))
+
+
+class EmbeddingStore:
+    """
+    Embeddings of answer texts, stored as rows of a float32 matrix on disk.
+
+    The matrix file only grows: new vectors are appended to it and it is read
+    through a memory map, so looking vectors up does not load the whole
+    matrix. A small SQLite table maps the content hash of each text to its row.
+    Appends hold the SQLite write lock, so several stores (or processes) can
+    share the files.
+    """
+
+    def __init__(self, name, directory=CACHE_DIR):
+        self.matrix_path = os.path.join(directory, f'{name}.f32')
+        self.index_path = os.path.join(directory, f'{name}.sqlite')
+        self.dim = None
+        self._rows = 0
+        self._matrix = None
+        self._lock = threading.Lock()
+        self._conn = None
+
+    def _connect(self):
+        """
+        Opens the row index on first use.
+        """
+        if self._conn is None:
+            os.makedirs(os.path.dirname(self.index_path), exist_ok=True)
+            self._conn = sqlite3.connect(self.index_path, check_same_thread=False, timeout=30,
+                                         isolation_level=None)
+            self._conn.execute("CREATE TABLE IF NOT EXISTS rows (key TEXT PRIMARY KEY, row INTEGER NOT NULL)")
+            self._conn.execute("CREATE TABLE IF NOT EXISTS meta (name TEXT PRIMARY KEY, value INTEGER)")
+        return self._conn
+
+    def _recount(self):
+        """
+        Re-reads the dimension and row count, which other stores or processes may
+        have changed. Call it after reading row numbers from the index: rows are
+        written to the file before they are committed to the index, so every row
+        read before the recount is then inside the matrix.
+        """
+        if self.dim is None:
+            dim = self._conn.execute("SELECT value FROM meta WHERE name = 'dim'").fetchone()
+            self.dim = dim[0] if dim else None
+        self._rows = self._file_rows()
+
+    def _file_rows(self):
+        """
+        Returns the number of complete rows in the matrix file. Rows are numbered by
+        their position in the file, so vectors written by an interrupted add() are
+        skipped rather than shifting the rows after them.
+        """
+        if self.dim is None or not os.path.exists(self.matrix_path):
+            return 0
+        return os.path.getsize(self.matrix_path) // (4 * self.dim)
+
+    def _map(self):
+        """
+        Returns the memory map of the matrix, remapped if rows were appended since.
+        """
+        if self._matrix is None or len(self._matrix) != self._rows:
+            self._matrix = (np.memmap(self.matrix_path, dtype=np.float32, mode='r', shape=(self._rows, self.dim))
+                            if self._rows else np.zeros((0, self.dim or 0), dtype=np.float32))
+        return self._matrix
+
+    def get(self, keys):
+        """
+        Looks up stored vectors.
+
+        Args:
+            keys (list): Content hashes of the texts.
+
+        Returns:
+            vectors (dict): The stored vector of each key that was found.
+        """
+        with self._lock:
+            conn = self._connect()
+            rows = {}
+            for start in range(0, len(keys), 500):
+                batch = keys[start:start + 500]
+                rows.update(conn.execute(f"SELECT key, row FROM rows WHERE key IN ({','.join('?' * len(batch))})",
+                                         batch).fetchall())
+            if not rows:
+                return {}
+            self._recount()
+            matrix = self._map()
+            return {key: np.array(matrix[row]) for key, row in rows.items() if row < self._rows}
+
+    def add(self, vectors):
+        """
+        Appends vectors to the matrix.
+
+        Args:
+            vectors (dict): Vectors keyed by the content hash of their text.
+        """
+        if not vectors:
+            return
+        with self._lock:
+            conn = self._connect()
+            # The write lock is taken before the rows are numbered, so concurrent writers append one at a time
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                self._recount()
+                vectors = {key: vector for key, vector in vectors.items()
+                           if conn.execute("SELECT 1 FROM rows WHERE key = ?", (key,)).fetchone() is None}
+                if not vectors:
+                    conn.execute("ROLLBACK")
+                    return
+                block = np.asarray(list(vectors.values()), dtype=np.float32)
+                if self.dim is None:
+                    self.dim = block.shape[1]
+                    conn.execute("INSERT OR REPLACE INTO meta (name, value) VALUES ('dim', ?)", (self.dim,))
+                elif block.shape[1] != self.dim:
+                    raise ValueError(f"Expected {self.dim} dimensional embeddings, got {block.shape[1]}")
+                start = self._file_rows()
+                with open(self.matrix_path, 'ab') as matrix:
+                    matrix.truncate(start * 4 * self.dim)  # Drop a partial row left by an interrupted write
+                    matrix.write(block.tobytes())
+                conn.executemany("INSERT INTO rows (key, row) VALUES (?, ?)",
+                                 [(key, start + offset) for offset, key in enumerate(vectors)])
+                conn.execute("COMMIT")
+            except BaseException:
+                conn.execute("ROLLBACK")
+                raise
+            self._rows = start + len(vectors)
+
+
+def hashing_embedder(dim=HASHING_DIM):
+    """
+    Returns a deterministic local stand-in for an embedding model: words and word
+    pairs are hashed into dim buckets and the counts are L2-normalized. Answers
+    sharing many words get similar vectors, which is enough to exercise the
+    clustering offline.
+
+    Args:
+        dim (int): The number of dimensions.
+
+    Returns:
+        embed (callable): Takes a list of texts and returns a list of vectors.
+    """
+    def embed(texts):
+        vectors = np.zeros((len(texts), dim), dtype=np.float32)
+        for i, text in enumerate(texts):
+            words = re.findall(r'\w+', text.lower())
+            for feature in words + [' '.join(pair) for pair in zip(words, words[1:])]:
+                bucket = int.from_bytes(hashlib.blake2b(feature.encode('utf-8'), digest_size=8).digest(), 'little')
+                vectors[i, bucket % dim] += 1.0
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        return list(vectors / np.where(norms == 0, 1.0, norms))
+
+    embed.name = f'hashing-{dim}'
+    return embed
+
+
+def azure_embedder(azurekey, endpoint, deployment=EMBEDDING_DEPLOYMENT):
+    """
+    Returns an embedding function backed by an Azure OpenAI embedding deployment
+    through llama-index.
+
+    Args:
+        azurekey (str): The Azure API key.
+        endpoint (str): The Azure endpoint.
+        deployment (str): The embedding deployment name.
+
+    Returns:
+        embed (callable): Takes a list of texts and returns a list of vectors.
+    """
+    from llama_index.embeddings.azure_openai import AzureOpenAIEmbedding
+
+    model = AzureOpenAIEmbedding(model=deployment,
+                                 deployment_name=deployment,
+                                 api_key=azurekey,
+                                 azure_endpoint=endpoint,
+                                 api_version=EMBEDDING_API_VERSION,
+                                 embed_batch_size=EMBEDDING_BATCH)
+
+    def embed(texts):
+        return model.get_text_embedding_batch(texts)
+
+    embed.name = f'azure-{deployment}'
+    return embed
+
+
+_stores = {}
+_stores_lock = threading.Lock()
+
+
+def get_store(name):
+    """
+    Returns the shared embedding store of an embedder.
+    """
+    with _stores_lock:
+        if name not in _stores:
+            _stores[name] = EmbeddingStore(f'embeddings-{name}')
+        return _stores[name]
+
+
+def embed_answers(texts, embed):
+    """
+    Embeds answer texts, reusing the vectors already stored for identical texts.
+
+    Args:
+        texts (list): The answer texts.
+        embed (callable): An embedder, see hashing_embedder and azure_embedder.
+
+    Returns:
+        vectors (ndarray): One float32 row per text.
+    """
+    store = get_store(embed.name)
+    normalized = [normalize_text(text) for text in texts]
+    keys = [content_hash(embed.name, text) for text in normalized]
+    vectors = store.get(sorted(set(keys)))
+
+    missing = {}
+    for key, text in zip(keys, normalized):
+        if key not in vectors and key not in missing:
+            missing[key] = text
+    missing_keys = list(missing)
+    for start in range(0, len(missing_keys), EMBEDDING_BATCH):
+        batch = missing_keys[start:start + EMBEDDING_BATCH]
+        new = dict(zip(batch, embed([missing[key] for key in batch])))
+        store.add(new)
+        vectors.update(new)
+
+    return np.asarray([vectors[key] for key in keys], dtype=np.float32)
+
+
+def cluster_answers(texts, embed, max_clusters=MAX_CLUSTERS):
+    """
+    Groups similar answers and picks the answer closest to the center of each group.
+
+    Args:
+        texts (list): The answer texts.
+        embed (callable): An embedder, see hashing_embedder and azure_embedder.
+        max_clusters (int): The maximum number of groups.
+
+    Returns:
+        clusters (list): (representative text, number of answers) tuples, largest group first.
+    """
+    from sklearn.cluster import KMeans
+
+    vectors = embed_answers(texts, embed)
+    distinct = len(np.unique(vectors, axis=0))
+    k = max(1, min(max_clusters, distinct))
+    if k == 1:
+        return [(texts[0], len(texts))]
+    model = KMeans(n_clusters=k, n_init=4, random_state=0).fit(vectors)
+    distances = model.transform(vectors)
+
+    clusters = []
+    for label in range(k):
+        members = np.flatnonzero(model.labels_ == label)
+        if len(members) == 0:
+            continue
+        representative = members[np.argmin(distances[members, label])]
+        clusters.append((texts[representative], len(members)))
+    return sorted(clusters, key=lambda cluster: -cluster[1])
+
+
+@lru_cache(maxsize=None)
+def get_embedder(azurekey, endpoint, mode=EMBEDDINGS):
+    """
+    Returns the embedder configured by ALAS_EMBEDDINGS, or None when clustering is
+    off (or llama-index is not installed).
+
+    Args:
+        azurekey (str): The Azure API key.
+        endpoint (str): The Azure endpoint.
+        mode (str): 'azure', 'hashing' or 'off'.
+
+    Returns:
+        embed (callable): The embedder, or None.
+    """
+    if mode == 'hashing':
+        return hashing_embedder()
+    if mode == 'azure':
+        try:
+            return azure_embedder(azurekey, endpoint)
+        except ImportError as e:
+            print(f"Answer clustering is off, the Azure embedder is unavailable: {e}")
+    return None
@@ -0,0 +1,128 @@
+# -*- coding: utf-8 -*-
+"""Streaming CSV and Parquet export of graded answers for the Source Data download."""
+
+import io
+from storage import COLUMNS, graded_answers
+
+EXPORT_CHUNK_ROWS = 5000
+EXPORT_FORMATS = {'csv': 'CSV', 'parquet': 'Parquet'}
+
+
+def parquet_available():
+    """
+    Returns True if pyarrow is installed, which the Parquet export needs.
+    """
+    try:
+        import pyarrow  # noqa: F401
+        return True
+    except ImportError:
+        return False
+
+
+def csv_chunks(chunks):
+    """
+    Encodes DataFrame chunks as one CSV document, a piece per chunk.
+
+    Args:
+        chunks (iterable): DataFrames with the same columns.
+
+    Yields:
+        text (str): The CSV of each chunk, with the header before the first one.
+    """
+    header = True
+    for chunk in chunks:
+        yield chunk.to_csv(index=False, header=header)
+        header = False
+    if header:  # No rows, still write the header
+        yield ','.join(COLUMNS) + '\n'
+
+
+class _Drain(io.RawIOBase):
+    """
+    A write-only file that keeps what was written until it is drained, so a
+    Parquet file can be sent while it is being written.
+    """
+
+    def __init__(self):
+        super().__init__()
+        self._pieces = []
+        self._position = 0
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        self._pieces.append(bytes(data))
+        self._position += len(data)
+        return len(data)
+
+    def tell(self):
+        return self._position
+
+    def drain(self):
+        """
+        Returns and forgets everything written since the last drain.
+        """
+        data = b''.join(self._pieces)
+        self._pieces = []
+        return data
+
+
+def _arrow_schema():
+    """
+    Returns the Arrow schema of the exported columns, taken from the table
+    definition so every chunk is written with the same types.
+    """
+    import pyarrow as pa
+    types = {'INTEGER': pa.int64(), 'FLOAT': pa.float64()}
+    return pa.schema([(column, types.get(str(graded_answers.c[column].type), pa.string()))
+                      for column in COLUMNS])
+
+
+def parquet_chunks(chunks):
+    """
+    Encodes DataFrame chunks as one Parquet file, a row group per chunk.
+
+    Args:
+        chunks (iterable): DataFrames with the COLUMNS.
+
+    Yields:
+        data (bytes): The bytes of the file written since the last piece.
+    """
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    schema = _arrow_schema()
+    sink = _Drain()
+    with pq.ParquetWriter(sink, schema, compression='zstd') as writer:
+        for chunk in chunks:
+            writer.write_table(pa.Table.from_pandas(chunk[COLUMNS], schema=schema, preserve_index=False))
+            data = sink.drain()
+            if data:
+                yield data
+    yield sink.drain()
+
+
+def export_answers(dataset, course, quizzes=None, file_format='csv', chunk_rows=EXPORT_CHUNK_ROWS):
+    """
+    Streams the graded answers of a course, or of some of its quizzes, as a CSV
+    or Parquet file. Only one chunk of rows is held in memory at a time.
+
+    Args:
+        dataset (DatasetStore): The store to read from.
+        course (str): The course ID.
+        quizzes (list): The quiz IDs to export, defaults to every quiz of the course.
+        file_format (str): 'csv' or 'parquet' (needs pyarrow).
+        chunk_rows (int): The number of rows read and encoded at a time.
+
+    Returns:
+        pieces (iterator): The file, piece by piece (str for CSV, bytes for Parquet).
+    """
+    chunks = dataset.iter_answers(course, quizzes, chunk_rows)
+    if file_format == 'parquet':
+        if not parquet_available():
+            raise ValueError("Parquet export requires pyarrow")
+        return parquet_chunks(chunks)
+    if file_format == 'csv':
+        return csv_chunks(chunks)
+    raise ValueError(f"Unknown export format {file_format!r}")
@@ -0,0 +1,243 @@
+# -*- coding: utf-8 -*-
+"""Concurrent grading pipeline used by check_new_data."""
+
+import os
+import random
+import time
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+from openai import RateLimitError
+
+GRADING_CONCURRENCY = int(os.environ.get('ALAS_GRADING_CONCURRENCY', '8'))
+MAX_RATE_LIMIT_RETRIES = 6
+BASE_BACKOFF = 1.0
+MAX_BACKOFF = 60.0
+
+
+def retry_after(error, attempt):
+    """
+    Returns how long to wait after a 429 from the LLM endpoint.
+
+    Args:
+        error (RateLimitError): The rate limit error raised by the client.
+        attempt (int): The number of retries made so far.
+
+    Returns:
+        delay (float): The number of seconds to sleep before retrying.
+    """
+    response = getattr(error, 'response', None)
+    if response is not None:
+        header = response.headers.get('retry-after')
+        try:
+            return min(float(header), MAX_BACKOFF)
+        except (TypeError, ValueError):
+            pass
+    delay = min(BASE_BACKOFF * 2 ** attempt, MAX_BACKOFF)
+    return delay / 2 + random.uniform(0, delay / 2)  # Jitter so workers don't retry in lockstep
+
+
+def with_backoff(function, *args, max_retries=MAX_RATE_LIMIT_RETRIES):
+    """
+    Calls function, sleeping and retrying whenever the LLM endpoint returns a 429.
+
+    Args:
+        function (callable): The function making the LLM call.
+        *args: The arguments passed to function.
+        max_retries (int): The number of retries before the error is raised.
+
+    Returns:
+        result: The return value of function.
+    """
+    attempt = 0
+    while True:
+        try:
+            return function(*args)
+        except RateLimitError as e:
+            if attempt >= max_retries:
+                raise
+            time.sleep(retry_after(e, attempt))
+            attempt += 1
+
+
+def grade_pipeline(answers, grade, concurrency=GRADING_CONCURRENCY, cancel=None):
+    """
+    Grades answers while they are still being fetched.
+
+    The calling thread consumes the answers iterable (which fetches Canvas
+    pages lazily) and hands each answer to a pool of at most concurrency
+    graders, so fetching the next page overlaps with grading the last one.
+
+    Args:
+        answers (iterable): Ungraded answer dictionaries, in submission order.
+        grade (callable): Takes an answer dictionary and returns (accuracy, completeness).
+        concurrency (int): The maximum number of grading calls in flight.
+        cancel (threading.Event): Once set, no further answers are submitted and
+            the calls that have not started are dropped.
+
+    Returns:
+        graded (list): The graded answer dictionaries in submission order. Answers
+            whose grading failed are reported and left out.
+    """
+    graded = []
+    with ThreadPoolExecutor(max_workers=max(1, int(concurrency))) as executor:
+        futures = []
+        for answer in answers:
+            if _cancelled(cancel):
+                break
+            futures.append((answer, executor.submit(with_backoff, grade, answer)))
+
+        for answer, future in futures:
+            if _cancelled(cancel):
+                executor.shutdown(cancel_futures=True)
+            if future.cancelled():
+                continue
+            try:
+                accuracy, completeness = future.result()
+            except Exception as e:
+                print(f"Error grading submission {answer['submission_id']} "
+                      f"question {answer['history_id']}: {e}")
+                continue
+            answer['accuracy'] = accuracy
+            answer['completeness'] = completeness
+            graded.append(answer)
+
+    return graded
+
+
+def _cancelled(cancel):
+    """
+    Returns True once the optional cancel event has been set.
+    """
+    return cancel is not None and cancel.is_set()
+
+
+@lru_cache(maxsize=1)
+def _encoding():
+    """
+    Returns the tiktoken encoding used by GPT-4o, or None if tiktoken is unavailable.
+    """
+    try:
+        import tiktoken
+        return tiktoken.get_encoding('o200k_base')
+    except Exception:  # Not installed, or the encoding could not be downloaded
+        return None
+
+
+def estimate_tokens(text):
+    """
+    Counts the tokens in a text with tiktoken when it is installed, otherwise
+    estimates them at about four characters per token.
+
+    Args:
+        text (str): The text to measure.
+
+    Returns:
+        tokens (int): The (estimated) token count.
+    """
+    text = str(text or '')
+    encoding = _encoding()
+    if encoding is not None:
+        return len(encoding.encode(text, disallowed_special=())) + 1
+    return len(text) // 4 + 1
+
+
+def split_by_budget(items, size, budget, max_items):
+    """
+    Splits items into consecutive groups whose total size stays within budget.
+
+    Args:
+        items (list): The items to split.
+        size (callable): Returns the size (e.g. token count) of an item.
+        budget (int): The maximum total size of a group. An item larger than the
+            budget gets a group of its own.
+        max_items (int): The maximum number of items in a group.
+
+    Returns:
+        groups (list): A list of item lists.
+    """
+    groups = []
+    group, total = [], 0
+    for item in items:
+        item_size = size(item)
+        if group and (total + item_size > budget or len(group) >= max_items):
+            groups.append(group)
+            group, total = [], 0
+        group.append(item)
+        total += item_size
+    if group:
+        groups.append(group)
+    return groups
+
+
+def grade_grouped(answers, grade_group, grade_one, budget, max_items, concurrency=GRADING_CONCURRENCY,
+                  cancel=None):
+    """
+    Grades answers to the same question several at a time.
+
+    Answers are grouped by question and split by token budget. Each group is
+    graded with one call, and any answer missing from (or invalid in) the
+    group's reply falls back to single-answer grading.
+
+    Args:
+        answers (list): Ungraded answer dictionaries, in submission order.
+        grade_group (callable): Takes a list of answers to one question and returns
+            {submission_id: (accuracy, completeness)} for the answers it graded.
+        grade_one (callable): Takes an answer dictionary and returns (accuracy, completeness).
+        budget (int): The maximum number of answer tokens in one request.
+        max_items (int): The maximum number of answers in one request.
+        concurrency (int): The maximum number of grading calls in flight.
+        cancel (threading.Event): Once set, the calls that have not started are dropped.
+
+    Returns:
+        graded (list): The graded answer dictionaries in submission order. Answers
+            whose grading failed are reported and left out.
+    """
+    questions = {}
+    for answer in answers:
+        questions.setdefault(answer['history_id'], []).append(answer)
+
+    groups = []
+    for question_answers in questions.values():
+        groups.extend(split_by_budget(question_answers,
+                                      lambda answer: estimate_tokens(answer['student_answer']),
+                                      budget, max_items))
+
+    grades = {}
+    with ThreadPoolExecutor(max_workers=max(1, int(concurrency))) as executor:
+        futures = [(group, executor.submit(with_backoff, grade_group, group)) for group in groups]
+
+        fallback = []  # Started as soon as their group's reply is in
+        for group, future in futures:
+            if _cancelled(cancel):
+                executor.shutdown(cancel_futures=True)
+            if future.cancelled():
+                continue
+            try:
+                group_grades = future.result()
+            except Exception as e:
+                print(f"Error grading a group of {len(group)} answers, grading them one by one: {e}")
+                group_grades = {}
+            for answer in group:
+                grade = group_grades.get(answer['submission_id'])
+                if grade is not None:
+                    grades[id(answer)] = grade
+                elif not _cancelled(cancel):
+                    fallback.append((answer, executor.submit(with_backoff, grade_one, answer)))
+
+        for answer, future in fallback:
+            if _cancelled(cancel):
+                executor.shutdown(cancel_futures=True)
+            if future.cancelled():
+                continue
+            try:
+                grades[id(answer)] = future.result()
+            except Exception as e:
+                print(f"Error grading submission {answer['submission_id']} "
+                      f"question {answer['history_id']}: {e}")
+
+    graded = []
+    for answer in answers:
+        if id(answer) in grades:
+            answer['accuracy'], answer['completeness'] = grades[id(answer)]
+            graded.append(answer)
+    return graded
@@ -2,13 +2,96 @@
 """Helper functions for app.py to create plots and create instructor feedback."""
 
 from __future__ import print_function
+import asyncio
 import json
+import os
 import re
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from functools import lru_cache, wraps
 import pandas as pd
 from openai import AzureOpenAI
 import requests
 import plotly.graph_objects as go
-from sklearn.linear_model import LinearRegression
+from batch_grading import (BATCH_API_VERSION, BATCH_DEPLOYMENT, BATCH_MOCK, MockBatchClient, answer_key,
+                           grade_batch)
+from canvas import get_client
+from cache import FIGURE_CACHE, GRADE_CACHE, SUMMARY_CACHE, content_hash, normalize_text
+from datastore import DATASET
+from dedup import DEDUP, DuplicateIndex
+from embeddings import CLUSTER_MIN_ANSWERS, MAX_CLUSTERS, cluster_answers, get_embedder
+from storage import COLUMNS, SCORE_METRICS
+from grading import (GRADING_CONCURRENCY, estimate_tokens, grade_grouped, grade_pipeline,
+                     split_by_budget, with_backoff)
+
+MODEL = "gpt-4o"
+API_VERSION = "2024-04-01-preview"
+WATERMARK_OVERLAP = timedelta(minutes=5)
+GRADING_MODE = os.environ.get('ALAS_GRADING_MODE', 'sync')  # 'sync', 'grouped' or 'batch'
+GROUP_TOKEN_BUDGET = int(os.environ.get('ALAS_GROUP_TOKEN_BUDGET', '6000'))
+GROUP_MAX_ANSWERS = int(os.environ.get('ALAS_GROUP_MAX_ANSWERS', '20'))
+FEEDBACK_CONCURRENCY = int(os.environ.get('ALAS_FEEDBACK_CONCURRENCY', '8'))
+FEEDBACK_TOKEN_BUDGET = int(os.environ.get('ALAS_FEEDBACK_TOKEN_BUDGET', '12000'))  # Answer tokens per prompt
+GRADE_MAX_REASKS = 2
+GRADE_PROMPT_VERSION = 2  # Bump whenever a grading prompt changes to invalidate cached grades
+FEEDBACK_PROMPT_VERSION = 1  # Bump whenever a feedback prompt changes to invalidate cached summaries
+
+
+@lru_cache(maxsize=None)
+def azure_client(azurekey, endpoint):
+    """
+    Returns a shared Azure OpenAI client, so concurrent calls reuse its connection pool.
+
+    Args:
+        azurekey (str): The Azure API key.
+        endpoint (str): The Azure endpoint.
+
+    Returns:
+        client (AzureOpenAI): The client for the given key and endpoint.
+    """
+    return AzureOpenAI(
+            api_key = azurekey,
+            azure_endpoint = endpoint,
+            api_version = API_VERSION
+        )
+
+
+@lru_cache(maxsize=None)
+def azure_batch_client(azurekey, endpoint):
+    """
+    Returns a shared Azure OpenAI client for the files and batches endpoints.
+
+    Args:
+        azurekey (str): The Azure API key.
+        endpoint (str): The Azure endpoint.
+
+    Returns:
+        client (AzureOpenAI): The client for the given key and endpoint.
+    """
+    return AzureOpenAI(
+            api_key = azurekey,
+            azure_endpoint = endpoint,
+            api_version = BATCH_API_VERSION
+        )
+
+
+def get_batch_client(azurekey, endpoint, mock=BATCH_MOCK):
+    """
+    Returns the client used in batch mode: the Azure client, or an offline
+    MockBatchClient when ALAS_BATCH_MOCK is 'on'.
+
+    Args:
+        azurekey (str): The Azure API key.
+        endpoint (str): The Azure endpoint.
+        mock (str): 'on' to use the mock client.
+
+    Returns:
+        client: An AzureOpenAI client created with BATCH_API_VERSION, or a MockBatchClient.
+    """
+    if mock == 'on':
+        return MockBatchClient()
+    return azure_batch_client(azurekey, endpoint)
 
 
 def get_courses(api_key):
@@ -21,25 +104,15 @@ def get_courses(api_key):
     Returns:
         courses_dict (dict): A dictionary of course IDs and their corresponding names.
     """
-    url = "https://canvas.harvard.edu/api/v1/courses"
-    headers = {"Authorization": f"Bearer {api_key}"}
-    courses = []
+    client = get_client(api_key)
     courses_dict={}
-    page = 1
 
-    while True:
-        params = {"page": page}
-        try:
-            response = requests.get(url, headers=headers, params=params, timeout=15)
-            response.raise_for_status()  # Raise an exception for 4xx/5xx status codes
-            courses_page = json.loads(response.text)  # Convert response text to dict
+    try:
+        for courses_page in client.paginate("courses", conditional=True):
             for course in courses_page:
                 courses_dict[str(course['id'])] = course['name']
-            if "next" not in response.links:
-                break  # No more pages to fetch
-            page += 1
-        except requests.exceptions.RequestException as e:
-            print("Error fetching courses:", e)
+    except requests.exceptions.RequestException as e:
+        print("Error fetching courses:", e)
 
     return courses_dict
 
@@ -55,31 +128,22 @@ def get_quizzes(api_key, course):
     Returns:
         sorted_quiz_dict (dict): A dictionary containing the quizzes for the given course.
     """
-    quizzes = []
+    client = get_client(api_key)
     quiz_dict = {}
     quiz_dict[str(course)] = {}
-    url = f"https://canvas.harvard.edu/api/v1/courses/{course}/quizzes"
-    headers = {"Authorization": f"Bearer {api_key}"}
-    page = 1
-    while True:
-        params = {"page": page, "per_page":"100"}
-        try:
-            response = requests.get(url, headers=headers, params=params, timeout=15)
-            response.raise_for_status()  # Raise an exception for 4xx/5xx status codes
-            quizzes_page = json.loads(response.text)  # Convert response text to dict
+
+    try:
+        for quizzes_page in client.paginate(f"courses/{course}/quizzes", conditional=True):
             for quiz in quizzes_page:
                 if quiz['html_url'].replace('https://canvas.harvard.edu/courses/','')[0:6] == course:
                     if 'Consolidation' in quiz['title']:
                         quiz_dict[str(course)][str(quiz['id'])] = quiz['title']
                 else:
                     pass
-            if "next" not in response.links:
-                break  # No more pages to fetch
-            page += 1
-        except requests.exceptions.RequestException as e:
-            print(f"Error fetching quizzes for course {course}: {e}")
+    except requests.exceptions.RequestException as e:
+        print(f"Error fetching quizzes for course {course}: {e}")
 
-        sorted_quiz_dict = dict(sorted(quiz_dict[course].items(), key=lambda item: item[1]))
+    sorted_quiz_dict = dict(sorted(quiz_dict[str(course)].items(), key=lambda item: item[1]))
 
     return sorted_quiz_dict
 
@@ -103,155 +167,410 @@ def extract_text(html):
 
     return extracted_text
 
-def check_new_data(course, quiz, apikey, azurekey, endpoint):
+def check_new_data(course, quiz, apikey, azurekey, endpoint, concurrency=GRADING_CONCURRENCY,
+                   mode=GRADING_MODE, batch_client=None, progress=None, cancel=None):
     """
     Checks for un-graded assessment submissions in the Canvas API.
-    
+
+    Submission pages are fetched while earlier answers are being graded, with at
+    most `concurrency` grading calls in flight at once. Only submissions made
+    since the quiz's stored watermark are requested from Canvas. In 'grouped'
+    mode answers to the same question are graded several per request, and in
+    'batch' mode all un-graded answers are graded through the Azure OpenAI
+    Batch API, which is cheaper but can take hours. Answers that duplicate an
+    earlier answer to the same question (see dedup.DuplicateIndex) are not sent:
+    they get the grade of that answer, which is recorded in propagated_from.
+
+    A cancelled sync stops fetching, drops the grading calls that have not
+    started and stores what was already graded; the watermark is not advanced,
+    so the next sync picks up the rest.
+
     Args:
         course (str): The selected course ID.
         quiz (str): The selected quiz ID.
         apikey (str): The canvas API key.
         azurekey (str): The Azure API key.
         endpoint (str): The Azure endpoint.
+        concurrency (int): The maximum number of concurrent grading calls.
+        mode (str): 'sync' to grade one answer per request, 'grouped' to grade several
+            answers per request, 'batch' to use the Batch API.
+        batch_client: The client used in batch mode, defaults to get_batch_client().
+        progress (callable): Called with a status message as the sync advances.
+        cancel (threading.Event): Set from another thread to stop the sync early.
 
     Returns:
-        None
+        graded (int): The number of answers graded, or None if the quiz could not be fetched.
     """
-    headers = {"Authorization": f"Bearer {apikey}"}
-    pre_graded_df = pd.read_json('Data/graded_quizzes.json')
-    un_graded = []
-    base_url = "https://canvas.harvard.edu/api/v1/courses/"
+    def report(message):
+        if progress is not None:
+            progress(message)
+
+    client = get_client(apikey)
+    graded = DATASET.graded_keys(course, quiz)  # (submission_id, question_id, attempt)
 
     try:
-        url = f"{base_url}{course}/quizzes/{quiz}"
-        response = requests.get(url, headers=headers, timeout=15)
-        response.raise_for_status()  # Raise an exception for 4xx/5xx status codes
-        quiz_page = json.loads(response.text)  # Convert response text to dict
+        quiz_page = client.get(f"courses/{course}/quizzes/{quiz}")
         assignment_id = quiz_page['assignment_id']
+        questions_page = [question for page in client.paginate(f"courses/{course}/quizzes/{quiz}/questions")
+                          for question in page]
 
-        url = f"{base_url}{course}/quizzes/{quiz}/questions"
-        response = requests.get(url, headers=headers, timeout=15)
-        response.raise_for_status()  # Raise an exception for 4xx/5xx status codes
-        questions_page = json.loads(response.text)  # Convert response text to dict
-        qdf = pd.DataFrame.from_dict(questions_page)
-        qdf = qdf[(qdf['question_type']=="essay_question")]
-
-        page = 1
+    except requests.exceptions.RequestException as e:
+        print(f"Error fetching quizzes for course {course}: {e}")
+        return None
+
+    #from quiz_page
+    quiz_fields = {'quiz_id': quiz,
+                   'quiz_type': quiz_page['quiz_type'],
+                   'quiz_title': quiz_page['title'],
+                   'quiz_question_count': quiz_page['question_count'],
+                   'quiz_points_possible': quiz_page['points_possible'],
+                   'question_points_possible': quiz_page['points_possible'],
+                   'course_id': course}
+
+    #from questions_page, prepared once per essay question
+    questions = {}
+    for question in questions_page:
+        if question['question_type'] == "essay_question" and question['quiz_id'] == int(quiz):
+            questions[question['id']] = {'question_text': extract_text(question['question_text']),
+                                         'question_name': question['question_name'],
+                                         'question_type': question['question_type'],
+                                         'question_answer': question['neutral_comments']}
+
+    # Only submissions made after the last fully synced one are requested; the overlap
+    # guards against clock skew and answers seen twice are dropped by the graded keys
+    watermark = DATASET.watermark(course, quiz)
+    sync = {'complete': True, 'submitted_at': watermark, 'answers': 0}
+
+    def un_graded_answers():
+        """
+        Yields every un-graded answer, fetching submission pages lazily.
+        """
+        url = f"courses/{course}/students/submissions"
+        params = {"student_ids[]":"all",
+                  "assignment_ids[]":assignment_id,
+                  "include[]":"submission_history",
+                  "per_page":"100"}
+        if watermark:
+            since = datetime.fromisoformat(watermark) - WATERMARK_OVERLAP
+            params["submitted_since"] = since.isoformat()
+        pages = client.paginate(url, params)
         while True:
-            url = f"{base_url}{course}/assignments/{assignment_id}/submissions"
-            params = {"page": page, "include[]":"submission_history","per_page":"100"}
-
-            response = requests.get(url, headers=headers, params=params, timeout=15)
-            response.raise_for_status()  # Raise an exception for 4xx/5xx status codes
-            submissions_page = json.loads(response.text)  # Convert response text to dict
+            if cancel is not None and cancel.is_set():
+                sync['complete'] = False
+                return
+            try:
+                submissions_page = next(pages)
+            except StopIteration:
+                return
+            except requests.exceptions.RequestException as e:
+                print(f"Error fetching submissions for quiz {quiz}: {e}")
+                sync['complete'] = False
+                return
             for user_submission in submissions_page:
                 submission_id = user_submission['id']
                 student_score = user_submission['score']
                 attempt = user_submission['attempt']
+                submitted_at = user_submission.get('submitted_at')
+                if submitted_at and (sync['submitted_at'] is None or
+                                     datetime.fromisoformat(submitted_at) > datetime.fromisoformat(sync['submitted_at'])):
+                    sync['submitted_at'] = submitted_at
+
+                submission = user_submission['submission_history'][0].get('submission_data')
+                if not submission:
+                    continue
+                for user_data in submission:
+                    question_id = user_data['question_id']
+                    if (submission_id, question_id, attempt) in graded or question_id not in questions:
+                        continue
+
+                    write_dict = {'history_id': question_id,
+                                  'submission_id': submission_id,
+                                  'student_score': student_score,
+                                  'answer_points_scored': user_data['points'],
+                                  'attempt': attempt,
+                                  'student_answer': user_data['text'],
+                                  'accuracy': '',
+                                  'completeness': '',
+                                  'propagated_from': None}
+                    write_dict.update(quiz_fields)
+                    write_dict.update(questions[question_id])
+                    sync['answers'] += 1
+                    yield {column: write_dict[column] for column in COLUMNS}
+            report(f"Fetched {sync['answers']} new answers")
+
+    grading = {'done': 0, 'lock': threading.Lock()}
+
+    def grade(write_dict):
+        """
+        Grades a single answer against the question's reference answer.
+        """
+        result = grade_answer(write_dict['student_answer'], write_dict['question_answer'], azurekey, endpoint)
+        with grading['lock']:
+            grading['done'] += 1
+            done = grading['done']
+        report(f"Graded {done} of {sync['answers']} new answers")
+        return result
+
+    # Only one answer of each group of (near-)duplicates to a question is graded
+    answers = []
+    duplicates = []  # (answer, the representative it duplicates)
+    indexes = {}
+
+    def representatives():
+        """
+        Yields the answers that don't duplicate an earlier answer to the same question.
+        """
+        for answer in un_graded_answers():
+            answers.append(answer)
+            if DEDUP == 'off':
+                yield answer
+                continue
+            index = indexes.setdefault(answer['history_id'], DuplicateIndex())
+            representative = index.find_or_add(answer['student_answer'], answer)
+            if representative is None:
+                yield answer
+            else:
+                duplicates.append((answer, representative))
+
+    if mode == 'batch':
+        grade_with_batch(list(representatives()),
+                         batch_client or get_batch_client(azurekey, endpoint),
+                         grade, cancel)
+    elif mode == 'grouped':
+        grade_with_groups(list(representatives()), azurekey, endpoint, concurrency, cancel)
+    else:
+        grade_pipeline(representatives(), grade, concurrency, cancel)
+
+    for answer, representative in duplicates:
+        if representative['accuracy'] != '':
+            answer['accuracy'] = representative['accuracy']
+            answer['completeness'] = representative['completeness']
+            answer['propagated_from'] = answer_key(representative)
+    if duplicates:
+        report(f"Copied grades to {len(duplicates)} duplicate answers")
+    un_graded = [answer for answer in answers if answer['accuracy'] != '']
 
-                check_if_graded = pre_graded_df[(pre_graded_df['submission_id']==submission_id)]
-
-                if user_submission['submission_history'][0].get('submission_data'):
-                    submission = user_submission['submission_history'][0].get('submission_data')
-                    for user_data in submission:
-                        write_dict = {'quiz_id':'',
-                                    'quiz_type':'', 
-                                    'quiz_title':'',
-                                    'history_id':'',
-                                    'submission_id':'',
-                                    'student_score':'',
-                                    'quiz_question_count':'',
-                                    'quiz_points_possible':'',
-                                    'question_points_possible':'',
-                                    'answer_points_scored':'',
-                                    'attempt':'',
-                                    'question_name':'',
-                                    'question_type':'',
-                                    'question_text':'',
-                                    'question_answer':'',
-                                    'student_answer':'',
-                                    'course_id':'',
-                                    'accuracy':'',
-                                    'completeness':''}
-
-                        if check_if_graded.empty:
-                            #from quiz_page
-                            write_dict['quiz_id'] = quiz
-                            write_dict['quiz_type'] = quiz_page['quiz_type']
-                            write_dict['quiz_title'] = quiz_page['title']
-                            write_dict['quiz_question_count'] = quiz_page['question_count']
-                            write_dict['quiz_points_possible'] = quiz_page['points_possible']
-                            write_dict['question_points_possible'] = quiz_page['points_possible']
-
-                            #from questions_df
-                            qdf_filtered = qdf[(qdf['id']==user_data['question_id'])
-                                                                & (qdf['quiz_id']==int(quiz))]
-
-                            write_dict['question_text'] = extract_text(qdf_filtered['question_text'].item())
-                            write_dict['question_name'] = qdf_filtered['question_name'].item()
-                            write_dict['question_type'] = qdf_filtered['question_type'].item()
-                            write_dict['question_answer'] = qdf_filtered['neutral_comments'].item()
-
-                            #from submission_data
-                            write_dict['history_id'] = user_data['question_id']
-                            write_dict['answer_points_scored'] = user_data['points']
-                            write_dict['student_answer'] = user_data['text']
-                            write_dict['attempt'] = attempt
-                            write_dict['submission_id'] = submission_id
-                            write_dict['student_score'] = student_score
-                            write_dict['course_id'] = course
-                            accuracy, completeness = grade_answer(write_dict['student_answer'],
-                                                                  write_dict['question_answer'],
-                                                                  azurekey,
-                                                                  endpoint)
-                            write_dict['accuracy'] = accuracy
-                            write_dict['completeness'] = completeness
-                            #reorder the columns
-                            write_dict = pd.DataFrame.from_records(write_dict, index=[0])
-                            write_dict = write_dict[pre_graded_df.columns]
-                            write_dict = write_dict.to_dict('records')[0]
-                            un_graded.append(write_dict)
-
-                        else:
-                            pass
-
-            if "next" not in response.links:
-                break  # No more pages to fetch
-            page += 1
+    if len(un_graded) > 0:
+        DATASET.append(un_graded)
+    report(f"Stored {len(un_graded)} newly graded answers")
 
-    except requests.exceptions.RequestException as e:
-        print(f"Error fetching quizzes for course {course}: {e}")
+    # Advance the watermark only when every submission up to it was fetched and graded
+    if sync['complete'] and len(un_graded) == sync['answers'] and sync['submitted_at'] != watermark:
+        DATASET.set_watermark(course, quiz, sync['submitted_at'])
 
-    if len(un_graded) > 0:
-        with open('Data/graded_quizzes.json', "r") as file:
-            data = file.read()[:-1]
-        with open('Data/graded_quizzes.json', "w") as file:
-            file.write(data)
-            file.write(',')
-        with open('Data/graded_quizzes.json', "a") as outfile:
-            for record in un_graded:
-                if record == un_graded[-1]:
-                    json.dump(record, outfile, indent=2)
-                else:
-                    json.dump(record, outfile, indent=2)
-                    outfile.write(',')
-                    outfile.write('\n')
-            outfile.write(']')
+    return len(un_graded)
 
-def grade_answer(student_answer, correct_answer, azurekey, endpoint):
+
+def grade_with_batch(answers, client, grade_one=None, cancel=None):
     """
-    Compares the student answer to the correct answer and assigns it a score for
-    accuracy and compeleteness.
-    
+    Grades answers through the Azure OpenAI Batch API. Cached grades are reused and
+    only the remaining answers are submitted. Answers whose batch reply failed or
+    did not validate are re-graded one by one with grade_one, if given. Grades are
+    cached under the batch deployment and BATCH_API_VERSION that produced them.
+
+    Args:
+        answers (list): The un-graded answer dictionaries.
+        client: An AzureOpenAI client created with BATCH_API_VERSION, or a MockBatchClient.
+        grade_one (callable): Takes an answer dictionary and returns (accuracy, completeness).
+        cancel (threading.Event): Set to cancel the batch and stop re-grading.
+
+    Returns:
+        graded (list): The graded answer dictionaries in their original order.
+    """
+    model = getattr(client, 'cache_model', BATCH_DEPLOYMENT)
+    pending = []
+    for answer in answers:
+        cached = cached_grade(answer['student_answer'], answer['question_answer'], model, BATCH_API_VERSION)
+        if cached is None:
+            pending.append(answer)
+        else:
+            answer['accuracy'], answer['completeness'] = cached
+
+    for answer in grade_batch(pending,
+                              client,
+                              lambda answer: grade_request(answer['student_answer'], answer['question_answer']),
+                              parse_grade,
+                              cancel=cancel):
+        store_grade(answer['student_answer'], answer['question_answer'],
+                    answer['accuracy'], answer['completeness'], model, BATCH_API_VERSION)
+
+    retry = [answer for answer in pending if answer['accuracy'] == '']
+    if grade_one is not None and retry:
+        print(f"Re-grading {len(retry)} answers without a valid batch reply")
+        grade_pipeline(retry, grade_one, cancel=cancel)
+
+    return [answer for answer in answers if answer['accuracy'] != '']
+
+
+def grade_with_groups(answers, azurekey, endpoint, concurrency=GRADING_CONCURRENCY, cancel=None):
+    """
+    Grades answers several per request, sharing the rubric and reference answer.
+    Cached grades are reused and only the remaining answers are sent. Grades from
+    the grouped prompt are cached apart from single-answer grades.
+
+    Args:
+        answers (list): The un-graded answer dictionaries.
+        azurekey (str): The Azure API key.
+        endpoint (str): The Azure endpoint.
+        concurrency (int): The maximum number of concurrent grading calls.
+        cancel (threading.Event): Set to stop grading early.
+
+    Returns:
+        graded (list): The graded answer dictionaries in their original order.
+    """
+    pending = []
+    for answer in answers:
+        cached = cached_grade(answer['student_answer'], answer['question_answer'], prompt='grouped')
+        if cached is None:
+            pending.append(answer)
+        else:
+            answer['accuracy'], answer['completeness'] = cached
+    graded_singly = set()
+
+    def grade_group(group):
+        """
+        Grades a group of answers to one question with a single request.
+        """
+        return grade_answer_group(group[0]['question_answer'],
+                                  {answer['submission_id']: answer['student_answer'] for answer in group},
+                                  azurekey, endpoint)
+
+    def grade_one(answer):
+        """
+        Grades a single answer that the group reply did not cover (grade_answer caches it).
+        """
+        graded_singly.add(answer_key(answer))
+        return grade_answer(answer['student_answer'], answer['question_answer'], azurekey, endpoint)
+
+    for answer in grade_grouped(pending, grade_group, grade_one,
+                                GROUP_TOKEN_BUDGET, GROUP_MAX_ANSWERS, concurrency, cancel):
+        if answer_key(answer) not in graded_singly:
+            store_grade(answer['student_answer'], answer['question_answer'],
+                        answer['accuracy'], answer['completeness'], prompt='grouped')
+
+    return [answer for answer in answers if answer['accuracy'] != '']
+
+
+def grade_group_messages(correct_answer, student_answers):
+    """
+    Builds the chat messages asking the LLM to grade several answers to one question.
+
     Args:
-        student_answer (str): The students response to the question.
         correct_answer (str): The correct answer to the question.
+        student_answers (dict): The student answers keyed by submission ID.
+
+    Returns:
+        messages (list): The system and user messages of the grading request.
+    """
+
+    answers = json.dumps([{'id': str(submission_id), 'answer': answer}
+                          for submission_id, answer in student_answers.items()],
+                         ensure_ascii=False)
+
+    prompt = ('Compare each student answer to the correct answer. '
+              'Rate the accuracy (a measure of how correct the student is) '
+              'and completeness (did the student identify all components of the '
+              'question) of each student answer according to these scales: '
+              'Accuracy Options: 1 - not accurate, 2 - somewhat accurate, '
+              '3 - mostly accurate, 4 - completely accurate. Completeness: '
+              '1 - incomplete, 2 - partially complete, 3 - mostly complete, '
+              '4 - complete. Grade every answer independently. Reply with a JSON '
+              'object of the form {"grades": [{"id": "<id>", "accuracy": 1-4, '
+              '"completeness": 1-4}]} with one entry per student answer.\n'
+              f'Correct Answer:{correct_answer}\n'
+              f'Student Answers:{answers}')
+
+    return [{"role": "system", "content": "You are a helpful course Teaching Assistant."},
+            {"role": "user", "content": f"{prompt}"}]
+
+
+def parse_group_grades(content, submission_ids):
+    """
+    Extracts the valid per-answer grades from a grouped grading reply.
+
+    Args:
+        content (str): The LLM reply, a JSON object with a "grades" list.
+        submission_ids (iterable): The submission IDs that were sent.
+
+    Returns:
+        grades (dict): (accuracy, completeness) keyed by submission ID, for every
+            entry whose id was sent and whose scores are integers from 1 to 4.
+    """
+    ids = {str(submission_id): submission_id for submission_id in submission_ids}
+    grades = {}
+    try:
+        entries = json.loads(content).get('grades', [])
+    except (ValueError, AttributeError):
+        return grades
+    for entry in entries:
+        if not isinstance(entry, dict) or str(entry.get('id')) not in ids:
+            continue
+        try:
+            scores = (validate_score(entry.get('accuracy')), validate_score(entry.get('completeness')))
+        except GradeValidationError:
+            continue
+        grades[ids[str(entry['id'])]] = scores
+    return grades
+
+
+def grade_answer_group(correct_answer, student_answers, azurekey, endpoint):
+    """
+    Grades several answers to the same question with a single LLM request.
+
+    Args:
+        correct_answer (str): The correct answer to the question.
+        student_answers (dict): The student answers keyed by submission ID.
         azurekey (str): The Azure API key.
         endpoint (str): The Azure endpoint.
 
     Returns:
-        accuracy (str): a score for how accurate the students response was
-        completeness (str): a score for how complete the students response was
+        grades (dict): (accuracy, completeness) keyed by submission ID. Answers whose
+            grade was missing or invalid in the reply are left out.
+    """
+
+    client = azure_client(azurekey, endpoint)
+
+    response = client.chat.completions.create(  model = MODEL,
+                                                response_format = {"type": "json_object"},
+                                                messages=grade_group_messages(correct_answer, student_answers)
+                                            )
+
+    return parse_group_grades(response.choices[0].message.content, student_answers.keys())
+
+
+class GradeValidationError(ValueError):
+    """Raised when a grading reply does not contain integer scores from 1 to 4."""
+
+
+GRADE_TOOL = {
+    "type": "function",
+    "function": {
+        "name": "record_grade",
+        "description": "Record the accuracy and completeness grade of the student answer.",
+        "parameters": {
+            "type": "object",
+            "properties": {
+                "accuracy": {"type": "integer", "enum": [1, 2, 3, 4]},
+                "completeness": {"type": "integer", "enum": [1, 2, 3, 4]},
+                "explanation": {"type": "string"}
+            },
+            "required": ["accuracy", "completeness", "explanation"]
+        }
+    }
+}
+
+
+def grade_request(student_answer, correct_answer):
+    """
+    Builds the chat completion arguments asking the LLM to grade one student answer
+    through the record_grade tool.
+
+    Args:
+        student_answer (str): The students response to the question.
+        correct_answer (str): The correct answer to the question.
+
+    Returns:
+        request (dict): The messages, tools and tool_choice of the grading request.
     """
 
     prompt = ('Compare the student answer to the correct answer. '
@@ -261,32 +580,155 @@ def grade_answer(student_answer, correct_answer, azurekey, endpoint):
               'Accuracy Options: 1 - not accurate, 2 - somewhat accurate, '
               '3 - mostly accurate, 4 - completely accurate. Completeness: '
               '1 - incomplete, 2 - partially complete, 3 - mostly complete, '
-              '4 - complete. Explain your answer briefly. Format your answer '
-              'as a list separated by |. Example: 3|4|explanation" +f"Student '
-              f'Answer:{student_answer}\nCorrect Answer:{correct_answer}.')
+              '4 - complete. Explain your answer briefly and record the grade '
+              'with the record_grade function.\n'
+              f'Student Answer:{student_answer}\nCorrect Answer:{correct_answer}.')
 
-    client = AzureOpenAI(
-            api_key = azurekey,
-            azure_endpoint = endpoint,
-            api_version = "2024-04-01-preview"
-        )
+    return {"messages": [{"role": "system", "content": "You are a helpful course Teaching Assistant."},
+                         {"role": "user", "content": f"{prompt}"}],
+            "tools": [GRADE_TOOL],
+            "tool_choice": {"type": "function", "function": {"name": "record_grade"}}}
 
-    response = client.chat.completions.create(  model = "gpt-4o",
-                                                messages=[
-                                                    {"role": "system", "content": "You are a helpful course Teaching Assistant."},
-                                                    {"role": "user", "content": f"{prompt}"}
-                                                ]
-                                            )
 
-    grade = response.choices[0].message.content.split('|')
+def validate_score(value):
+    """
+    Checks that a score is an integer from 1 to 4.
+
+    Args:
+        value: The score from the LLM reply.
+
+    Returns:
+        score (int): The validated score.
+    """
+    if isinstance(value, str) and value.strip().isdigit():
+        value = int(value.strip())
+    if isinstance(value, bool) or not isinstance(value, int) or not 1 <= value <= 4:
+        raise GradeValidationError(f"score {value!r} is not an integer from 1 to 4")
+    return value
+
+
+def parse_grade(message):
+    """
+    Extracts and validates the accuracy and completeness scores from a grading reply.
+
+    Args:
+        message: The reply message, either a client message object or a dict
+            (as returned by the Batch API).
+
+    Returns:
+        accuracy (int): a score for how accurate the students response was
+        completeness (int): a score for how complete the students response was
+    """
+    if isinstance(message, dict):
+        tool_calls = message.get('tool_calls') or []
+        arguments = tool_calls[0]['function']['arguments'] if tool_calls else None
+    else:
+        tool_calls = message.tool_calls or []
+        arguments = tool_calls[0].function.arguments if tool_calls else None
+    if arguments is None:
+        raise GradeValidationError("reply did not call record_grade")
+
+    try:
+        grade = json.loads(arguments)
+    except ValueError:
+        raise GradeValidationError(f"record_grade arguments are not JSON: {arguments!r}")
+    if not isinstance(grade, dict):
+        raise GradeValidationError(f"record_grade arguments are not an object: {arguments!r}")
+
+    accuracy = validate_score(grade.get('accuracy'))
+    completeness = validate_score(grade.get('completeness'))
+
+    return accuracy, completeness
+
+
+def _grade_cache_key(student_answer, correct_answer, model=MODEL, api_version=API_VERSION, prompt='single'):
+    """
+    Returns the grade cache key of a (student answer, correct answer) pair graded by a model.
+    """
+    return content_hash(normalize_text(student_answer), correct_answer,
+                        GRADE_PROMPT_VERSION, prompt, model, api_version)
+
+
+def cached_grade(student_answer, correct_answer, model=MODEL, api_version=API_VERSION, prompt='single'):
+    """
+    Looks up a previously computed grade.
+
+    Args:
+        student_answer (str): The students response to the question.
+        correct_answer (str): The correct answer to the question.
+        model (str): The deployment that graded it.
+        api_version (str): The API version it was graded with.
+        prompt (str): 'single' for the record_grade prompt, 'grouped' for the grouped JSON prompt.
+
+    Returns:
+        grade (tuple): The cached (accuracy, completeness), or None.
+    """
+    cached = GRADE_CACHE.get(_grade_cache_key(student_answer, correct_answer, model, api_version, prompt))
+    return tuple(cached) if cached is not None else None
+
+
+def store_grade(student_answer, correct_answer, accuracy, completeness, model=MODEL, api_version=API_VERSION,
+                prompt='single'):
+    """
+    Caches a grade so an identical pair is never sent to the LLM again.
+
+    Args:
+        student_answer (str): The students response to the question.
+        correct_answer (str): The correct answer to the question.
+        accuracy (str): The accuracy score.
+        completeness (str): The completeness score.
+        model (str): The deployment that graded it.
+        api_version (str): The API version it was graded with.
+        prompt (str): 'single' for the record_grade prompt, 'grouped' for the grouped JSON prompt.
+    """
+    GRADE_CACHE.set(_grade_cache_key(student_answer, correct_answer, model, api_version, prompt),
+                    [accuracy, completeness])
+
+
+def grade_answer(student_answer, correct_answer, azurekey, endpoint):
+    """
+    Compares the student answer to the correct answer and assigns it a score for
+    accuracy and compeleteness. Grades are cached on disk by the content of both
+    answers, so regrading an identical pair makes no network call. A reply without
+    valid scores is re-asked up to GRADE_MAX_REASKS times before GradeValidationError
+    is raised.
+    
+    Args:
+        student_answer (str): The students response to the question.
+        correct_answer (str): The correct answer to the question.
+        azurekey (str): The Azure API key.
+        endpoint (str): The Azure endpoint.
+
+    Returns:
+        accuracy (int): a score for how accurate the students response was
+        completeness (int): a score for how complete the students response was
+    """
+
+    cached = cached_grade(student_answer, correct_answer)
+    if cached is not None:
+        return cached
+
+    client = azure_client(azurekey, endpoint)
+    request = grade_request(student_answer, correct_answer)
+
+    for attempt in range(GRADE_MAX_REASKS + 1):
+        response = client.chat.completions.create(model = MODEL, **request)
+        try:
+            accuracy, completeness = parse_grade(response.choices[0].message)
+            break
+        except GradeValidationError as e:
+            if attempt == GRADE_MAX_REASKS:
+                raise
+            request = dict(request, messages=request['messages'] + [
+                {"role": "user", "content": (f'Your previous reply was invalid: {e}. Call record_grade '
+                                             'with integer accuracy and completeness scores from 1 to 4.')}])
 
-    accuracy = grade[0]
-    completeness = grade[1]
+    store_grade(student_answer, correct_answer, accuracy, completeness)
 
     return accuracy, completeness
 
 
-def instructor_feedback(course, quiz, azurekey, endpoint):
+def instructor_feedback(course, quiz, azurekey, endpoint, concurrency=FEEDBACK_CONCURRENCY):
     """
     Bins all grades for all questions on a quiz, and outputs summative feedback 
     of all students performance.
@@ -296,119 +738,313 @@ def instructor_feedback(course, quiz, azurekey, endpoint):
         quiz (str): The quiz ID.
         azurekey (str): The Azure API key.
         endpoint (str): The Azure endpoint.
+        concurrency (int): The maximum number of concurrent LLM calls.
+
+    Returns:
+        level_three_feedback (str): a summary of all students performance
+    """
+    return asyncio.run(instructor_feedback_async(course, quiz, azurekey, endpoint, concurrency))
+
+
+async def instructor_feedback_async(course, quiz, azurekey, endpoint, concurrency=FEEDBACK_CONCURRENCY):
+    """
+    Runs the feedback hierarchy and returns the level three summary (see
+    instructor_feedback_stream).
+
+    Args:
+        course (str): The course ID.
+        quiz (str): The quiz ID.
+        azurekey (str): The Azure API key.
+        endpoint (str): The Azure endpoint.
+        concurrency (int): The maximum number of concurrent LLM calls.
 
     Returns:
         level_three_feedback (str): a summary of all students performance
     """
+    l3_feedback = ''
+    async for kind, text in instructor_feedback_stream(course, quiz, azurekey, endpoint, concurrency):
+        if kind == 'summary':
+            l3_feedback = text
+    return l3_feedback
+
 
-    df = pd.read_json('Data/graded_quizzes.json')
+async def instructor_feedback_stream(course, quiz, azurekey, endpoint, concurrency=FEEDBACK_CONCURRENCY):
+    """
+    Runs the feedback hierarchy as a dependency graph, yielding results as they
+    become available: every level one bucket of every question is summarized
+    concurrently, each question's level two summary starts as soon as its own
+    buckets are done, and level three waits for all of them and is streamed
+    token by token. Summaries are memoized by the content of their inputs, so
+    only buckets whose members changed since the last run are summarized again.
 
-    # Filter the DataFrame
-    subset = df[(df['quiz_id'] == int(quiz)) & (df['course_id'] == int(course))]
+    Args:
+        course (str): The course ID.
+        quiz (str): The quiz ID.
+        azurekey (str): The Azure API key.
+        endpoint (str): The Azure endpoint.
+        concurrency (int): The maximum number of concurrent LLM calls.
+
+    Yields:
+        event (tuple): (kind, text), where kind is
+            'progress': a status message,
+            'question': a question name and its level two summary, as "question: summary",
+            'token': the next piece of the level three summary,
+            'summary': the complete level three summary (always the last event).
+    """
+
+    subset = DATASET.quiz_frame(course, quiz)
     questions = list(subset['question_name'].unique())
+    executor = ThreadPoolExecutor(max_workers=max(1, int(concurrency)))
+    call = _pool_caller(executor)
+    embed = get_embedder(azurekey, endpoint)
+
+    async def question_feedback(question):
+        """
+        Summarizes the level one buckets of a question, then the question itself.
+        Returns the question and its level two cache key along with the summary, and
+        whether the summary was cached (it is not when clustering failed).
+        """
+        question_subset = subset[subset['question_name'] == question]
+        buckets = feedback_buckets(question_subset)
+        bucket_keys = [bucket_key(question, grade_value, metric, bucket, embed)
+                       for metric, grade_value, bucket in buckets]
+        l2_key = content_hash('level_two', question, bucket_keys, FEEDBACK_PROMPT_VERSION, MODEL)
+        l2_feedback = SUMMARY_CACHE.get(l2_key)
+        cacheable = True
+        if l2_feedback is None:
+            level_one = await asyncio.gather(*(bucket_feedback_async(question, grade_value, metric, bucket,
+                                                                     azurekey, endpoint, call)
+                                               for metric, grade_value, bucket in buckets))
+            cacheable = all(bucket_cacheable for _, bucket_cacheable in level_one)
+            l2_feedback = await call(level_two_feedback, [feedback for feedback, _ in level_one],
+                                     question, azurekey, endpoint)
+            if cacheable:
+                SUMMARY_CACHE.set(l2_key, l2_feedback)
+        return question, l2_key, l2_feedback, cacheable
+
+    tasks = [asyncio.ensure_future(question_feedback(question)) for question in questions]
+    try:
+        yield 'progress', f"Summarizing {len(questions)} questions"
+        results = {}
+        for done in asyncio.as_completed(tasks):
+            question, l2_key, l2_feedback, cacheable = await done
+            results[question] = (l2_key, l2_feedback, cacheable)
+            yield 'question', f"{question}: {l2_feedback}"
+            yield 'progress', f"Summarized {len(results)} of {len(questions)} questions"
+
+        level_two = {question: results[question][1] for question in questions}
+        l3_key = content_hash('level_three', [results[question][0] for question in questions],
+                              FEEDBACK_PROMPT_VERSION, MODEL)
+        l3_feedback = SUMMARY_CACHE.get(l3_key)
+        if l3_feedback is None:
+            yield 'progress', "Summarizing the quiz"
+            loop = asyncio.get_running_loop()
+            stream = await call(level_three_stream, level_two, azurekey, endpoint)
+            pieces = []
+            while True:
+                piece = await loop.run_in_executor(executor, next, stream, None)
+                if piece is None:
+                    break
+                pieces.append(piece)
+                yield 'token', piece
+            l3_feedback = ''.join(pieces)
+            if all(results[question][2] for question in questions):
+                SUMMARY_CACHE.set(l3_key, l3_feedback)
+        else:
+            yield 'token', l3_feedback
+        yield 'summary', l3_feedback
+    finally:
+        for task in tasks:
+            task.cancel()
+        executor.shutdown(wait=False, cancel_futures=True)
 
-    level_one = {}
-    level_two = {}
 
-    for question in questions:
-        # Group the 'subset' into buckets based on 'accuracy' value
-        level_one[question] = level_one_feedback(question, subset, azurekey, endpoint)
-        level_two[question] = level_two_feedback(level_one[question], question, azurekey, endpoint)
+def feedback_buckets(question_subset):
+    """
+    Groups the answers to a question into buckets by accuracy and completeness score.
+
+    Args:
+        question_subset (DataFrame): The graded answers to one question.
 
-    return level_three_feedback(level_two, azurekey, endpoint)
+    Returns:
+        buckets (list): (metric, grade value, bucket DataFrame) tuples, accuracy
+            buckets 1-4 followed by completeness buckets 1-4.
+    """
+    return [(metric, grade_value, question_subset[question_subset[metric] == grade_value])
+            for metric in ['accuracy', 'completeness']
+            for grade_value in [1, 2, 3, 4]]
 
 
-def level_one_feedback(question, subset, azurekey, endpoint):
+def bucket_key(question, grade_value, metric, bucket, embed=None):
     """
-    Bins all grades for each question on a quiz, and outputs a summary string for each bin
-    containing what students did well/not well on per question
+    Returns the summary cache key of a level one bucket.
 
     Args:
-        question (str): The question name being graded (Question 1, Question 2, etc.).
-        subset (str): The subset df of all graded data.
+        question (str): The question name.
+        grade_value (int): The score shared by the bucket (1-4).
+        metric (str): 'accuracy' or 'completeness'.
+        bucket (DataFrame): The graded answers in the bucket.
+        embed (callable): The embedder clustering the bucket, or None when clustering is off.
+
+    Returns:
+        key (str): A hash of the bucket's question, score, answers and reference answer.
+    """
+    return content_hash('level_one', question, int(grade_value), metric,
+                        sorted(str(answer) for answer in bucket['student_answer']),
+                        sorted(str(answer) for answer in bucket['question_answer'].unique()),
+                        FEEDBACK_PROMPT_VERSION, MODEL, embed.name if embed is not None else None,
+                        CLUSTER_MIN_ANSWERS, MAX_CLUSTERS)
+
+
+def _pool_caller(executor):
+    """
+    Returns a coroutine function that runs blocking LLM calls on executor, whose
+    size caps the number of calls in flight, retrying 429s with backoff.
+    """
+    loop = asyncio.get_running_loop()
+
+    async def call(function, *args):
+        return await loop.run_in_executor(executor, with_backoff, function, *args)
+
+    return call
+
+
+async def bucket_feedback_async(question, grade_value, metric, bucket, azurekey, endpoint, call):
+    """
+    Summarizes one bucket. Buckets of CLUSTER_MIN_ANSWERS or more answers are
+    first clustered by embedding, and only one representative answer per
+    cluster is sent, with the cluster's size. The answers are then summarized
+    with map-reduce when they exceed FEEDBACK_TOKEN_BUDGET: they are split into
+    chunks that fit the budget, the chunks are summarized in parallel, and the
+    chunk summaries are combined (in further rounds if they are themselves over budget).
+
+    Args:
+        question (str): The question name.
+        grade_value (int): The score shared by the bucket (1-4).
+        metric (str): 'accuracy' or 'completeness'.
+        bucket (DataFrame): The graded answers that received grade_value for metric.
         azurekey (str): The Azure API key.
         endpoint (str): The Azure endpoint.
+        call (coroutine function): Runs a blocking LLM call, see _pool_caller.
 
     Returns:
-        l1_feedback (list): a list of feedback strings per question
+        question_feedback (str): a feedback string for the bucket
+        cacheable (bool): False when clustering failed and the answers were sent
+            unclustered; that summary is not cached, nor are those built on it.
     """
-    question_subset = subset[subset['question_name'] == question]
+    if len(bucket) == 0:
+        return f"No students received a {grade_value} for this question.", True
 
-    # Initialize an empty dictionary to hold the buckets
-    a_buckets = {}
-    c_buckets = {}
+    embed = get_embedder(azurekey, endpoint)
+    cache_key = bucket_key(question, grade_value, metric, bucket, embed)
+    cached = SUMMARY_CACHE.get(cache_key)
+    if cached is not None:
+        return cached, True
 
-    l1_feedback = []
+    student_answers = [str(answer) for answer in bucket['student_answer']]
+    correct_answer = bucket['question_answer'].unique().item()
 
-    for grade_value in [1, 2, 3, 4]:
-        # Group the 'subset' into buckets based on 'accuracy' value
-        a_buckets[grade_value] = question_subset[question_subset['accuracy'] == grade_value]
-        c_buckets[grade_value] = question_subset[question_subset['completeness'] == grade_value]
+    clustered = False
+    cacheable = True
+    if embed is not None and len(student_answers) >= CLUSTER_MIN_ANSWERS:
+        try:
+            clusters = await call(cluster_answers, student_answers, embed)
+            student_answers = [f"({size} students) {text}" for text, size in clusters]
+            clustered = True
+        except Exception as e:
+            print(f"Error clustering answers to {question}, sending them all: {e}")
+            cacheable = False
+
+    chunks = split_by_budget(student_answers, estimate_tokens, FEEDBACK_TOKEN_BUDGET, len(student_answers))
+    summaries = await asyncio.gather(*(call(summarize_answers, grade_value, metric, chunk,
+                                            correct_answer, azurekey, endpoint, clustered)
+                                       for chunk in chunks))
+    while len(summaries) > 1:
+        groups = split_by_budget(summaries, estimate_tokens, FEEDBACK_TOKEN_BUDGET, len(summaries))
+        if len(groups) == len(summaries):
+            groups = [summaries[i:i + 2] for i in range(0, len(summaries), 2)]  # Always make progress
+        summaries = await asyncio.gather(*(call(reduce_summaries, grade_value, metric, group,
+                                                correct_answer, azurekey, endpoint)
+                                           for group in groups))
+
+    question_feedback = summaries[0]
+    if cacheable:
+        SUMMARY_CACHE.set(cache_key, question_feedback)
+    return question_feedback, cacheable
+
+
+def summarize_answers(grade_value, metric, student_answers, correct_answer, azurekey, endpoint,
+                      clustered=False):
+    """
+    Summarizes why the given students received their score.
+
+    Args:
+        grade_value (int): The score shared by the answers (1-4).
+        metric (str): 'accuracy' or 'completeness'.
+        student_answers (list): The student answers to summarize.
+        correct_answer (str): The correct answer to the question.
+        azurekey (str): The Azure API key.
+        endpoint (str): The Azure endpoint.
+        clustered (bool): Each answer stands for a cluster of similar answers and is
+            prefixed with the cluster's size.
+
+    Returns:
+        summary (str): a feedback string for the answers
+    """
+    grouping = ('Each answer represents a group of similar answers and starts with '
+                'the number of students in the group. ' if clustered else '')
+    prompt = ('Summarize in 200 words or less why the following students '
+              f'received an {grade_value} for {metric} (on a scale of 1-4)'
+               f'compared to the correct answer. {grouping}Start your response with "For {metric.capitalize()}, "'
+               f'Student answers:{student_answers}'
+               f'Correct answer: {correct_answer}.')
+
+    return _feedback_completion(prompt, azurekey, endpoint)
+
+
+def reduce_summaries(grade_value, metric, summaries, correct_answer, azurekey, endpoint):
+    """
+    Combines summaries of groups of students who received the same score.
+
+    Args:
+        grade_value (int): The score shared by the students (1-4).
+        metric (str): 'accuracy' or 'completeness'.
+        summaries (list): The partial summaries to combine.
+        correct_answer (str): The correct answer to the question.
+        azurekey (str): The Azure API key.
+        endpoint (str): The Azure endpoint.
+
+    Returns:
+        summary (str): a single feedback string for all the students
+    """
+    prompt = ('Combine the following partial summaries, each about a group of students who '
+              f'received an {grade_value} for {metric} (on a scale of 1-4) compared to the '
+              'correct answer, into a single summary of 200 words or less. '
+              f'Start your response with "For {metric.capitalize()}, "'
+              f'Partial summaries:{summaries}'
+              f'Correct answer: {correct_answer}.')
+
+    return _feedback_completion(prompt, azurekey, endpoint)
 
-    for grade_value, bucket in a_buckets.items():
-        if len(bucket) == 0:
-            l1_feedback.append(f"No students received a {grade_value} for this question.")
-        else:
-            student_answers = list(bucket['student_answer'])
-            correct_answer = bucket['question_answer'].unique().item()
-            prompt = ('Summarize in 200 words or less why the following students '
-                      f'received an {grade_value} for accuracy (on a scale of 1-4)'
-                       'compared to the correct answer. Start your response with "For Accuracy, "'
-                       f'Student answers:{student_answers}'
-                       f'Correct answer: {correct_answer}.')
-
-            client = AzureOpenAI(
-                    api_key = azurekey,
-                    azure_endpoint = endpoint,
-                    api_version = "2024-04-01-preview"
-                )
-
-            response = client.chat.completions.create(
-                    model = "gpt-4o",
-                    messages=[
-                    {"role": "system", "content": ('You are a helpful course Teaching Assistant '
-                                                    'designed to provide helpful feedback to an '
-                                                    'Instructor regarding how their students are '
-                                                    'performing on quizzes.')},
-                    {"role": "user", "content": f"{prompt}"}
-                    ]
-                    )
-
-            question_feedback = response.choices[0].message.content
-            l1_feedback.append(question_feedback)
-    for grade_value, bucket in c_buckets.items():
-        if len(bucket) == 0:
-            l1_feedback.append(f"No students received a {grade_value} for this question.")
-        else:
-            student_answers = list(bucket['student_answer'])
-            correct_answer = bucket['question_answer'].unique().item()
-            prompt = ('Summarize in 200 words or less why the following students '
-                      f'received an {grade_value} for completeness (on a scale of 1-4)'
-                       'compared to the correct answer. Start your response with "For Completeness, "'
-                       f'Student answers:{student_answers}'
-                       f'Correct answer: {correct_answer}.')
-
-            client = AzureOpenAI(
-                    api_key = azurekey,
-                    azure_endpoint = endpoint,
-                    api_version = "2024-04-01-preview"
-                )
-
-            response = client.chat.completions.create(
-                    model = "gpt-4o",
-                    messages=[
-                    {"role": "system", "content": ('You are a helpful course Teaching Assistant '
-                                                    'designed to provide helpful feedback to an '
-                                                    'Instructor regarding how their students are '
-                                                    'performing on quizzes.')},
-                    {"role": "user", "content": f"{prompt}"}
-                    ]
-                    )
 
-            question_feedback = response.choices[0].message.content
-            l1_feedback.append(question_feedback)
+def _feedback_completion(prompt, azurekey, endpoint):
+    """
+    Sends a feedback prompt with the Teaching Assistant system message and returns the reply.
+    """
+    client = azure_client(azurekey, endpoint)
 
-    return l1_feedback
+    response = client.chat.completions.create(
+            model = MODEL,
+            messages=[
+            {"role": "system", "content": ('You are a helpful course Teaching Assistant '
+                                            'designed to provide helpful feedback to an '
+                                            'Instructor regarding how their students are '
+                                            'performing on quizzes.')},
+            {"role": "user", "content": f"{prompt}"}
+            ]
+            )
+
+    return response.choices[0].message.content
 
 
 def level_two_feedback(level_one, question, azurekey, endpoint):
@@ -431,14 +1067,10 @@ def level_two_feedback(level_one, question, azurekey, endpoint):
              f' set complete answers apart from incomplete answers. {level_one}.')
 
 
-    client = AzureOpenAI(
-            api_key = azurekey,
-            azure_endpoint = endpoint,
-            api_version = "2024-04-01-preview"
-        )
+    client = azure_client(azurekey, endpoint)
 
     response = client.chat.completions.create(
-                model = "gpt-4o",
+                model = MODEL,
                 messages=[
                     {"role": "system", "content": ('You are a helpful course Teaching Assistant'
                                                    'designed to provide helpful feedback to an '
@@ -452,43 +1084,114 @@ def level_two_feedback(level_one, question, azurekey, endpoint):
     return l2_feedback
 
 
-def level_three_feedback(level_two, azurekey, endpoint):
+def level_three_stream(level_two, azurekey, endpoint):
     """
-    Condenses level two feedback to give a summary of student performance per quiz
+    Starts the level three summary as a streamed completion. The request is sent
+    before this returns, so a 429 is raised here and can be retried.
 
     Args:
-        level_two (str): a summary of how students did per question.
+        level_two (dict): a summary of how students did per question.
         azurekey (str): The Azure API key.
         endpoint (str): The Azure endpoint.
 
     Returns:
-        l1_feedback (list): a list of feedback strings per question
+        pieces (iterator): the summary text, piece by piece as it is generated
     """
+    client = azure_client(azurekey, endpoint)
 
+    response = client.chat.completions.create(
+        model = MODEL,
+        messages=level_three_messages(level_two),
+        stream=True
+    )
+
+    def pieces():
+        for chunk in response:
+            if chunk.choices and chunk.choices[0].delta.content:
+                yield chunk.choices[0].delta.content
+
+    return pieces()
+
+
+def level_three_messages(level_two):
+    """
+    Returns the chat messages asking for the level three summary.
+    """
     prompt = ('Summarize the feedback provided in less than 200 words. '
               f'Feedback: {level_two}.')
 
-    client = AzureOpenAI(
-            api_key = azurekey,
-            azure_endpoint = endpoint,
-            api_version = "2024-04-01-preview"
-        )
+    return [
+        {"role": "system", "content": ('You are a helpful course Teaching Assistant '
+                                       'designed to provide helpful feedback to an '
+                                       'Instructor regarding how their students are '
+                                       'performing on quizzes.')},
+        {"role": "user", "content": f"{prompt}"}
+    ]
 
-    response = client.chat.completions.create(
-        model = "gpt-4o",
-        messages=[
-            {"role": "system", "content": ('You are a helpful course Teaching Assistant '
-                                           'designed to provide helpful feedback to an '
-                                           'Instructor regarding how their students are '
-                                           'performing on quizzes.')},
-            {"role": "user", "content": f"{prompt}"}
-        ]
-    )
 
-    question_feedback = response.choices[0].message.content
-    return question_feedback
+def quiz_figure_version(course, quiz):
+    """
+    Returns the data version of the per-question plots of a quiz.
+    """
+    return DATASET.quiz_version(course, quiz)
+
+
+def group_figure_version(course, quiz):
+    """
+    Returns the data version of the cross-quiz plots of a quiz: new answers to any
+    quiz in its group change the plots.
+    """
+    return DATASET.group_version(DATASET.quiz_title(course, quiz).split(' ')[0])
+
+
+def cached_figure(version):
+    """
+    Caches the figures of a plot function in FIGURE_CACHE, keyed by
+    (function, course, quiz, version(course, quiz)), so a figure is rebuilt only
+    after new grades were written for the data it shows. Cached figures are
+    shared between sessions and must not be modified in place.
+
+    Args:
+        version (callable): Takes (course, quiz) and returns the version of the plotted data.
+
+    Returns:
+        decorator: Wraps a plot function taking (course, quiz).
+    """
+    def decorator(function):
+        @wraps(function)
+        def wrapper(course, quiz):
+            key = (function.__name__, str(course), str(quiz), version(course, quiz))
+            cached = FIGURE_CACHE.get(key)
+            if cached is not None:
+                return cached
+            fig = function(course, quiz)
+            FIGURE_CACHE.set(key, fig, len(fig.to_json()))
+            return fig
+        return wrapper
+    return decorator
+
+
+def question_score_counts(course, quiz, metric):
+    """
+    Returns how many answers to each question of a quiz received each score.
+
+    Args:
+        course (str): The course ID.
+        quiz (str): The quiz ID.
+        metric (str): 'accuracy' or 'completeness'.
+
+    Returns:
+        score_counts (DataFrame): question_name and one column of counts per score.
+    """
+    counts = DATASET.score_counts(course, quiz)
+    counts = counts[counts['metric'] == metric]
+    return (counts.pivot_table(index='question_name', columns='score', values='count',
+                               aggfunc='sum', fill_value=0)
+                  .rename_axis(columns=metric)
+                  .reset_index())
 
 
+@cached_figure(quiz_figure_version)
 def accuracy_per_question_bar(course, quiz):
     """
     Generate a bar plot for accuracy per question.
@@ -501,12 +1204,9 @@ def accuracy_per_question_bar(course, quiz):
     plot: A bar plot of accuracy per question.
     """
 
-    df = pd.read_json('Data/graded_quizzes.json')
-
-    subset = df[(df['quiz_id'] == int(quiz)) & (df['course_id'] == int(course))] # Filter the df
-    quiz_group = subset['quiz_title'].unique().item().split(' ')[0]
+    quiz_group = DATASET.quiz_title(course, quiz).split(' ')[0]
 
-    score_counts = subset.groupby(['question_name', 'accuracy']).size().unstack(fill_value=0).reset_index() # Count students who scored 1, 2, 3, or 4 per question
+    score_counts = question_score_counts(course, quiz, 'accuracy') # Count students who scored 1, 2, 3, or 4 per question
 
     # Normalize the counts as a percentage of the total responses per question
     score_counts.set_index('question_name', inplace=True)
@@ -538,6 +1238,7 @@ def accuracy_per_question_bar(course, quiz):
 
     return fig
 
+@cached_figure(quiz_figure_version)
 def completeness_per_question_bar(course, quiz):
     """
     Generate a bar plot for completeness per question.
@@ -550,15 +1251,10 @@ def completeness_per_question_bar(course, quiz):
     plot: A bar plot of completeness per question.
     """
 
-    # Load the JSON data
-    df = pd.read_json('Data/graded_quizzes.json')
-
-    # Filter the DataFrame
-    subset = df[(df['quiz_id'] == int(quiz)) & (df['course_id'] == int(course))]
-    quiz_group = subset['quiz_title'].unique().item().split(' ')[0]
+    quiz_group = DATASET.quiz_title(course, quiz).split(' ')[0]
 
     # Count the number of students who scored 1, 2, 3, or 4 per question
-    score_counts = subset.groupby(['question_name', 'completeness']).size().unstack(fill_value=0).reset_index()
+    score_counts = question_score_counts(course, quiz, 'completeness')
 
     # Normalize the counts as a percentage of the total responses per question
     score_counts.set_index('question_name', inplace=True)
@@ -590,6 +1286,7 @@ def completeness_per_question_bar(course, quiz):
 
     return fig
 
+@cached_figure(quiz_figure_version)
 def avg_of_scores_hist(course, quiz):
     """
     Generate a histogram for the distribution of scores.
@@ -602,16 +1299,13 @@ def avg_of_scores_hist(course, quiz):
     plot: A histogram of the distribution of scores.
     """
 
-    # Load the JSON data
-    df = pd.read_json('Data/graded_quizzes.json')
+    quiz_group = DATASET.quiz_title(course, quiz).split(' ')[0]
 
-    # Filter the DataFrame
-    subset = df[(df['quiz_id'] == int(quiz)) & (df['course_id'] == int(course))]
-
-    quiz_group = subset['quiz_title'].unique().item().split(' ')[0]
-
-    # Calculate average accuracy and completeness per question
-    average_metrics = subset.groupby('question_name')[['accuracy', 'completeness']].mean().reset_index()
+    # Calculate average accuracy and completeness per question from the score counts
+    counts = DATASET.score_counts(course, quiz)
+    totals = (counts.assign(total=counts['score'] * counts['count'])
+                    .groupby(['question_name', 'metric'])[['total', 'count']].sum())
+    average_metrics = (totals['total'] / totals['count']).unstack('metric').reset_index()
     average_metrics['accuracy'] = average_metrics['accuracy'].round(2)
     average_metrics['completeness'] = average_metrics['completeness'].round(2)
 
@@ -645,76 +1339,114 @@ def avg_of_scores_hist(course, quiz):
 
     return fig
 
-def accuracy(course, quiz):
+def quiz_group_trends(quiz_group, metrics=SCORE_METRICS):
     """
-    Generate a line plot for accuracy across similar questions.
-    
+    Computes the mean score of every quiz in a quiz group and a least squares
+    trend line over the quiz numbers, for every metric in one pass.
+
+    Args:
+        quiz_group (str): The first word of the quiz titles.
+        metrics (list): The score columns to fit.
+
+    Returns:
+        trends (DataFrame): quiz_title, quiz_num and, per metric, the rounded mean
+            and its trend value in '<metric>_trend', ordered by quiz_num.
+    """
+    trends = DATASET.group_means(quiz_group).copy()
+    for metric in metrics:
+        trends[metric] = trends[metric].round(2)  # Round the averages to the nearest hundredth
+
+    # Closed-form simple regression: accumulate the sums in one pass, then solve per
+    # metric. A quiz without a mean for a metric (no valid scores) is left out of
+    # that metric's sums only.
+    sums = {metric: dict.fromkeys(['n', 'sx', 'sxx', 'sy', 'sxy'], 0.0) for metric in metrics}
+    for row in trends.itertuples(index=False):
+        x = row.quiz_num
+        if pd.isna(x):
+            continue
+        for metric in metrics:
+            y = getattr(row, metric)
+            if pd.isna(y):
+                continue
+            total = sums[metric]
+            total['n'] += 1
+            total['sx'] += x
+            total['sxx'] += x * x
+            total['sy'] += y
+            total['sxy'] += x * y
+
+    for metric in metrics:
+        n, sx, sxx, sy, sxy = (sums[metric][key] for key in ['n', 'sx', 'sxx', 'sy', 'sxy'])
+        denominator = n * sxx - sx * sx
+        slope = (n * sxy - sx * sy) / denominator if denominator else 0.0
+        intercept = (sy - slope * sx) / n if n else 0.0
+        trends[f'{metric}_trend'] = intercept + slope * trends['quiz_num']
+    return trends
+
+
+def trend_plot(course, quiz, metric):
+    """
+    Generate a line plot of a metric's average across the quizzes of a quiz group.
+
     Parameters:
     course_id (int): The course identifier.
     quiz_id (int): The quiz identifier.
+    metric (str): 'accuracy' or 'completeness'.
 
     Returns:
-    plot: A line plot of accuracy across similar questions.
+    plot: A line plot of the metric across similar quizzes.
     """
 
-    # Load the JSON data
-    df = pd.read_json('Data/graded_quizzes.json')
-
-    # Filter the DataFrame
-    subset = df[(df['quiz_id'] == int(quiz)) & (df['course_id'] == int(course))]
-    quiz_group = subset['quiz_title'].unique().item().split(' ')[0]
+    quiz_group = DATASET.quiz_title(course, quiz).split(' ')[0]
+    name = metric.capitalize()
 
-    # Filter for quizzes with the same quiz group in the title
-    quiz_group_subset = df[df['quiz_title'].str.startswith(quiz_group)]
-
-    # Calculate average total accuracy per quiz
-    average_accuracy_per_quiz = quiz_group_subset.groupby('quiz_title')['accuracy'].mean().reset_index()
-
-    # Round the averages to the nearest hundredth
-    average_accuracy_per_quiz['accuracy'] = average_accuracy_per_quiz['accuracy'].round(2)
-
-    # Extract the numerical part of the quiz titles for proper sorting
-    average_accuracy_per_quiz['quiz_num'] = average_accuracy_per_quiz['quiz_title'].str.extract(r'(\d+)').astype(int)
-
-    # Sort the dataframe by the numerical part of the quiz titles
-    average_accuracy_per_quiz = average_accuracy_per_quiz.sort_values(by='quiz_num')
+    # Quizzes with the same quiz group in the title, in quiz number order
+    trends = quiz_group_trends(quiz_group)
 
     # Create a plotly figure
     fig = go.Figure()
 
-    # Plot the average accuracy per quiz
+    # Plot the average per quiz
     fig.add_trace(go.Scatter(
-        x=average_accuracy_per_quiz['quiz_title'],
-        y=average_accuracy_per_quiz['accuracy'],
+        x=trends['quiz_title'],
+        y=trends[metric],
         mode='lines+markers',
-        name='Average Accuracy',
+        name=f'Average {name}',
         hoverinfo='text',
-        text=average_accuracy_per_quiz['accuracy']))
-
-    x = average_accuracy_per_quiz['quiz_num'].values.reshape(-1, 1)
-    y = average_accuracy_per_quiz['accuracy'].values
-
-    model = LinearRegression()
-    model.fit(x, y)
-    trend_line = model.predict(x)
+        text=trends[metric]))
 
     fig.add_trace(go.Scatter(
-        x=average_accuracy_per_quiz['quiz_title'],
-        y=trend_line,
+        x=trends['quiz_title'],
+        y=trends[f'{metric}_trend'],
         mode='lines',
-        name='Average Total Accuracy Over Time',
+        name=f'Average Total {name} Over Time',
         line=dict(dash='dash')
     ))
 
     fig.update_layout(
-        title=f'Average Total Accuracy for {quiz_group} Quizzes',
+        title=f'Average Total {name} for {quiz_group} Quizzes',
         xaxis_title='Quiz Title',
-        yaxis_title='Average Total Accuracy',
+        yaxis_title=f'Average Total {name}',
         margin=dict(l=40, r=40, t=40, b=40)
     )
 
     return fig
 
+@cached_figure(group_figure_version)
+def accuracy(course, quiz):
+    """
+    Generate a line plot for accuracy across similar questions.
+    
+    Parameters:
+    course_id (int): The course identifier.
+    quiz_id (int): The quiz identifier.
+
+    Returns:
+    plot: A line plot of accuracy across similar questions.
+    """
+    return trend_plot(course, quiz, 'accuracy')
+
+@cached_figure(group_figure_version)
 def completeness(course, quiz):
     """
     Generate a line plot for completeness across similar questions.
@@ -726,63 +1458,4 @@ def completeness(course, quiz):
     Returns:
     plot: A line plot of completeness across similar questions.
     """
-
-    # Load the JSON data
-    df = pd.read_json('Data/graded_quizzes.json')
-
-    subset = df[(df['quiz_id'] == int(quiz)) & (df['course_id'] == int(course))] # Filter the df
-    quiz_group = subset['quiz_title'].unique().item().split(' ')[0]
-
-    # Filter for quizzes with the same quiz group in the title
-    quiz_group_subset = df[df['quiz_title'].str.startswith(quiz_group)]
-
-    # Calculate average total completeness per quiz
-    average_completeness_per_quiz = quiz_group_subset.groupby('quiz_title')['completeness'].mean().reset_index()
-
-    # Round the averages to the nearest hundredth
-    average_completeness_per_quiz['completeness'] = average_completeness_per_quiz['completeness'].round(2)
-
-    # Extract the numerical part of the quiz titles for proper sorting
-    average_completeness_per_quiz['quiz_num'] = average_completeness_per_quiz['quiz_title'].str.extract(r'(\d+)').astype(int)
-
-    # Sort the dataframe by the numerical part of the quiz titles
-    average_completeness_per_quiz = average_completeness_per_quiz.sort_values(by='quiz_num')
-
-    # Create a plotly figure
-    fig = go.Figure()
-
-    # Plot the average completeness per quiz
-    fig.add_trace(go.Scatter(
-        x=average_completeness_per_quiz['quiz_title'],
-        y=average_completeness_per_quiz['completeness'],
-        mode='lines+markers',
-        name='Average Completeness',
-        hoverinfo='text',
-        text=average_completeness_per_quiz['completeness']))
-
-    # Add trend line using linear regression
-    X = average_completeness_per_quiz['quiz_num'].values.reshape(-1, 1)
-    y = average_completeness_per_quiz['completeness'].values
-
-    # Fit linear regression model
-    model = LinearRegression()
-    model.fit(X, y)
-    trend_line = model.predict(X)
-
-    fig.add_trace(go.Scatter(
-        x=average_completeness_per_quiz['quiz_title'],
-        y=trend_line,
-        mode='lines',
-        name='Average Total Completeness Over Time',
-        line=dict(dash='dash')
-    ))
-
-    # Update layout
-    fig.update_layout(
-        title=f'Average Total Completeness for {quiz_group} Quizzes',
-        xaxis_title='Quiz Title',
-        yaxis_title='Average Total completeness',
-        margin=dict(l=40, r=40, t=40, b=40)
-    )
-
-    return fig
\ No newline at end of file
+    return trend_plot(course, quiz, 'completeness')
@@ -0,0 +1,782 @@
+# -*- coding: utf-8 -*-
+"""SQLite storage backend for graded quiz answers."""
+
+import argparse
+import os
+import re
+from datetime import datetime, timezone
+import pandas as pd
+from sqlalchemy import (Column, Float, Index, Integer, MetaData, PrimaryKeyConstraint, String, Table,
+                        Text, case, create_engine, event, func, select, text)
+from sqlalchemy.dialects.sqlite import insert
+
+DB_PATH = 'Data/graded_quizzes.db'
+JSON_PATH = 'Data/graded_quizzes.json'
+
+# Column order of the records written by check_new_data
+COLUMNS = ['quiz_id',
+           'quiz_type',
+           'quiz_title',
+           'history_id',
+           'submission_id',
+           'student_score',
+           'quiz_question_count',
+           'quiz_points_possible',
+           'question_points_possible',
+           'answer_points_scored',
+           'attempt',
+           'question_name',
+           'question_type',
+           'question_text',
+           'question_answer',
+           'student_answer',
+           'course_id',
+           'accuracy',
+           'completeness',
+           'propagated_from']
+
+metadata = MetaData()
+
+graded_answers = Table(
+    'graded_answers', metadata,
+    Column('id', Integer, primary_key=True, autoincrement=True),
+    Column('quiz_id', Integer, nullable=False),
+    Column('quiz_type', String),
+    Column('quiz_title', String),
+    Column('history_id', Integer),
+    Column('submission_id', Integer, nullable=False),
+    Column('student_score', Float),
+    Column('quiz_question_count', Integer),
+    Column('quiz_points_possible', Float),
+    Column('question_points_possible', Float),
+    Column('answer_points_scored', Float),
+    Column('attempt', Integer),
+    Column('question_name', String),
+    Column('question_type', String),
+    Column('question_text', Text),
+    Column('question_answer', Text),
+    Column('student_answer', Text),
+    Column('course_id', Integer, nullable=False),
+    Column('accuracy', Integer),
+    Column('completeness', Integer),
+    # Set when the grade was copied from a duplicate answer: submission_id-history_id-attempt of that answer
+    Column('propagated_from', String),
+    Index('ix_graded_answers_course_quiz', 'course_id', 'quiz_id'),
+    Index('ix_graded_answers_quiz', 'quiz_id'),
+    Index('ix_graded_answers_submission', 'submission_id'),
+    Index('ix_graded_answers_question', 'question_name'),
+    Index('ix_graded_answers_quiz_title', 'quiz_title'),
+    # One row per answer; makes re-running a sync from two sessions idempotent
+    Index('ux_graded_answers_answer', 'submission_id', 'history_id', 'attempt', unique=True),
+)
+
+sync_watermarks = Table(
+    'sync_watermarks', metadata,
+    Column('course_id', Integer, primary_key=True),
+    Column('quiz_id', Integer, primary_key=True),
+    Column('submitted_at', String, nullable=False),  # Latest Canvas submitted_at seen (ISO 8601)
+)
+
+sync_jobs = Table(
+    'sync_jobs', metadata,
+    Column('id', Integer, primary_key=True, autoincrement=True),
+    Column('course_id', Integer, nullable=False),
+    Column('quiz_id', Integer, nullable=False),
+    Column('quiz_title', String),
+    Column('status', String, nullable=False),  # pending, running, done or failed
+    Column('attempts', Integer, nullable=False, default=0),
+    Column('graded', Integer),
+    Column('error', Text),
+    Column('updated_at', String),
+    Index('ux_sync_jobs_quiz', 'course_id', 'quiz_id', unique=True),
+    Index('ix_sync_jobs_status', 'status'),
+)
+
+# Number of answers per (course, quiz, question, metric, score), kept up to date by
+# the triggers below in the same transaction as the insert into graded_answers
+score_counts = Table(
+    'score_counts', metadata,
+    Column('course_id', Integer, nullable=False),
+    Column('quiz_id', Integer, nullable=False),
+    Column('question_name', String, nullable=False),  # '' when the answer has none
+    Column('metric', String, nullable=False),  # accuracy or completeness
+    Column('score', Integer, nullable=False),
+    Column('count', Integer, nullable=False),
+    PrimaryKeyConstraint('course_id', 'quiz_id', 'question_name', 'metric', 'score'),
+)
+
+# One row per quiz with its group (the first word of the title) and number, the
+# keys of the cross-quiz trend plots; written with every append
+quiz_index = Table(
+    'quiz_index', metadata,
+    Column('course_id', Integer, primary_key=True),
+    Column('quiz_id', Integer, primary_key=True),
+    Column('quiz_title', String),
+    Column('quiz_group', String),
+    Column('quiz_num', Integer),  # First number in the title, NULL if it has none
+    Column('max_id', Integer),  # Highest graded_answers.id written for the quiz, its data version
+    Index('ix_quiz_index_group', 'quiz_group'),
+)
+
+SCORE_METRICS = ['accuracy', 'completeness']
+
+_SCORE_COUNT_TRIGGER = """
+CREATE TRIGGER IF NOT EXISTS tr_score_counts_{metric} AFTER INSERT ON graded_answers
+WHEN NEW.{metric} IS NOT NULL
+BEGIN
+    INSERT INTO score_counts (course_id, quiz_id, question_name, metric, score, count)
+    VALUES (NEW.course_id, NEW.quiz_id, COALESCE(NEW.question_name, ''), '{metric}', NEW.{metric}, 1)
+    ON CONFLICT (course_id, quiz_id, question_name, metric, score) DO UPDATE SET count = count + 1;
+END
+"""
+
+_engines = {}
+
+
+def get_engine(path=DB_PATH):
+    """
+    Returns the (cached) SQLAlchemy engine for the database, creating the schema if needed.
+
+    Args:
+        path (str): The path of the SQLite database file.
+
+    Returns:
+        engine (Engine): The engine bound to the database.
+    """
+    if path not in _engines:
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        engine = create_engine(f"sqlite:///{path}")
+
+        @event.listens_for(engine, "connect")
+        def _set_pragmas(dbapi_connection, connection_record):
+            cursor = dbapi_connection.cursor()
+            cursor.execute("PRAGMA journal_mode=WAL")  # Readers don't block the writer
+            cursor.execute("PRAGMA busy_timeout=30000")  # Wait for concurrent writers
+            cursor.close()
+
+        metadata.create_all(engine)
+        _add_missing_columns(engine)
+        _create_score_triggers(engine)
+        _fill_quiz_index(engine)
+        _engines[path] = engine
+    return _engines[path]
+
+
+def _add_missing_columns(engine):
+    """
+    Adds the graded_answers and quiz_index columns introduced after a database was created.
+    """
+    with engine.begin() as conn:
+        for table in (graded_answers, quiz_index):
+            existing = {row[1] for row in conn.execute(text(f"PRAGMA table_info({table.name})"))}
+            for column in table.columns:
+                if column.name not in existing:
+                    conn.execute(text(f"ALTER TABLE {table.name} ADD COLUMN {column.name} "
+                                      f"{column.type.compile(engine.dialect)}"))
+
+
+def _create_score_triggers(engine):
+    """
+    Installs the score_counts triggers, and fills score_counts from the answers
+    already stored when a database created before the table is opened.
+    """
+    with engine.begin() as conn:
+        missing = conn.execute(text("SELECT COUNT(*) FROM sqlite_master WHERE type = 'trigger' "
+                                    "AND name LIKE 'tr_score_counts_%'")).scalar() < len(SCORE_METRICS)
+        for metric in SCORE_METRICS:
+            conn.execute(text(_SCORE_COUNT_TRIGGER.format(metric=metric)))
+    if missing:
+        rebuild_score_counts(engine)
+
+
+def rebuild_score_counts(engine=None):
+    """
+    Recomputes score_counts from graded_answers.
+
+    Args:
+        engine (Engine): The database engine, defaults to get_engine().
+    """
+    engine = engine or get_engine()
+    with engine.begin() as conn:
+        conn.execute(score_counts.delete())
+        for metric in SCORE_METRICS:
+            conn.execute(text(f"INSERT INTO score_counts (course_id, quiz_id, question_name, metric, score, count) "
+                              f"SELECT course_id, quiz_id, COALESCE(question_name, ''), '{metric}', {metric}, COUNT(*) "
+                              f"FROM graded_answers WHERE {metric} IS NOT NULL "
+                              f"GROUP BY course_id, quiz_id, COALESCE(question_name, ''), {metric}"))
+
+
+def quiz_index_row(course, quiz, title, max_id=None):
+    """
+    Returns the quiz_index row of a quiz.
+
+    Args:
+        course: The course ID.
+        quiz: The quiz ID.
+        title (str): The quiz title, e.g. "Pathways 3 Consolidation".
+        max_id (int): The highest row id of the quiz's graded answers.
+
+    Returns:
+        row (dict): course_id, quiz_id, quiz_title, quiz_group ("Pathways"), quiz_num (3) and max_id.
+    """
+    title = title or ''
+    number = re.search(r'(\d+)', title)
+    return {'course_id': int(course),
+            'quiz_id': int(quiz),
+            'quiz_title': title,
+            'quiz_group': title.split(' ')[0],
+            'quiz_num': int(number.group(1)) if number else None,
+            'max_id': max_id}
+
+
+def _index_quizzes(conn, rows):
+    """
+    Writes the quiz_index rows of quizzes.
+
+    Args:
+        conn (Connection): The connection of the transaction that stored the answers.
+        rows (list): course_id, quiz_id, quiz_title and max_id (the highest row id
+            of the quiz's graded answers) of each quiz.
+    """
+    if not rows:
+        return
+    statement = insert(quiz_index)
+    statement = statement.on_conflict_do_update(
+        index_elements=['course_id', 'quiz_id'],
+        set_={column: statement.excluded[column]
+              for column in ['quiz_title', 'quiz_group', 'quiz_num', 'max_id']})
+    conn.execute(statement, [quiz_index_row(row['course_id'], row['quiz_id'], row['quiz_title'], row['max_id'])
+                             for row in rows])
+
+
+def _fill_quiz_index(engine):
+    """
+    Indexes the stored quizzes when a database created before quiz_index (or its
+    max_id column) is opened.
+    """
+    with engine.begin() as conn:
+        indexed = conn.execute(select(func.count(), func.count(quiz_index.c.max_id))).one()
+        if indexed[0] and indexed[0] == indexed[1]:
+            return
+        rows = conn.execute(select(graded_answers.c.course_id, graded_answers.c.quiz_id,
+                                   func.max(graded_answers.c.quiz_title).label('quiz_title'),
+                                   func.max(graded_answers.c.id).label('max_id'))
+                            .group_by(graded_answers.c.course_id, graded_answers.c.quiz_id)).mappings().all()
+        _index_quizzes(conn, rows)
+
+
+def _to_int(value):
+    """
+    Converts a grade written as text (e.g. " 3") to an integer, or None if it is not a number.
+    """
+    try:
+        return int(str(value).strip())
+    except (TypeError, ValueError):
+        return None
+
+
+def _prepare(records):
+    """
+    Restricts records to the table columns and replaces NaN/empty values with NULL.
+    """
+    rows = []
+    for record in records:
+        row = {}
+        for column in COLUMNS:
+            value = record.get(column)
+            if value == '' or (isinstance(value, float) and pd.isna(value)):
+                value = None
+            row[column] = value
+        row['accuracy'] = _to_int(row['accuracy'])
+        row['completeness'] = _to_int(row['completeness'])
+        rows.append(row)
+    return rows
+
+
+def append_records(records, engine=None):
+    """
+    Appends graded answers in a single transaction. Answers that are already stored are skipped.
+
+    Args:
+        records (list): A list of graded answer dictionaries keyed by COLUMNS.
+        engine (Engine): The database engine, defaults to get_engine().
+
+    Returns:
+        inserted (int): The number of new rows written.
+    """
+    if not records:
+        return 0
+    engine = engine or get_engine()
+    rows = _prepare(records)
+    statement = insert(graded_answers).on_conflict_do_nothing()
+    with engine.begin() as conn:
+        before = conn.execute(select(func.max(graded_answers.c.id))).scalar() or 0
+        result = conn.execute(statement, rows)
+        # Only the rows just inserted are scanned, and quizzes whose rows all conflicted keep their max_id
+        appended = conn.execute(select(graded_answers.c.course_id, graded_answers.c.quiz_id,
+                                       func.max(graded_answers.c.quiz_title).label('quiz_title'),
+                                       func.max(graded_answers.c.id).label('max_id'))
+                                .where(graded_answers.c.id > before)
+                                .group_by(graded_answers.c.course_id, graded_answers.c.quiz_id)).mappings().all()
+        _index_quizzes(conn, appended)
+    return result.rowcount
+
+
+def import_json(path=JSON_PATH, engine=None):
+    """
+    One-time import of the legacy graded_quizzes.json array into the database.
+    Nothing is imported if the database already holds graded answers.
+
+    Args:
+        path (str): The path of the legacy JSON file.
+        engine (Engine): The database engine, defaults to get_engine().
+
+    Returns:
+        imported (int): The number of rows imported.
+    """
+    engine = engine or get_engine()
+    if not os.path.exists(path) or data_version(engine) > 0:
+        return 0
+    df = pd.read_json(path)
+    if df.empty:
+        return 0
+    imported = append_records(df.to_dict('records'), engine)
+    rebuild_score_counts(engine)
+    return imported
+
+
+def data_version(engine=None):
+    """
+    Returns a value that changes whenever graded answers are appended.
+
+    Args:
+        engine (Engine): The database engine, defaults to get_engine().
+
+    Returns:
+        version (int): The highest row id in the table.
+    """
+    engine = engine or get_engine()
+    with engine.connect() as conn:
+        return conn.execute(select(func.max(graded_answers.c.id))).scalar() or 0
+
+
+def quiz_version(course, quiz, engine=None):
+    """
+    Returns a value that changes whenever graded answers of a quiz are appended.
+
+    Args:
+        course (str): The course ID.
+        quiz (str): The quiz ID.
+        engine (Engine): The database engine, defaults to get_engine().
+
+    Returns:
+        version (int): The highest row id of the quiz's answers.
+    """
+    engine = engine or get_engine()
+    statement = (select(quiz_index.c.max_id)
+                 .where(quiz_index.c.course_id == int(course))
+                 .where(quiz_index.c.quiz_id == int(quiz)))
+    with engine.connect() as conn:
+        return conn.execute(statement).scalar() or 0
+
+
+def group_version(quiz_group, engine=None):
+    """
+    Returns a value that changes whenever graded answers of any quiz in a quiz group are appended.
+
+    Args:
+        quiz_group (str): The first word of the quiz titles.
+        engine (Engine): The database engine, defaults to get_engine().
+
+    Returns:
+        version (int): The highest row id of the group's answers.
+    """
+    engine = engine or get_engine()
+    statement = select(func.max(quiz_index.c.max_id)).where(quiz_index.c.quiz_group == quiz_group)
+    with engine.connect() as conn:
+        return conn.execute(statement).scalar() or 0
+
+
+def _read(statement, engine):
+    """
+    Runs a select statement and returns the rows as a DataFrame.
+    """
+    with engine.connect() as conn:
+        return pd.read_sql(statement, conn)
+
+
+def read_quiz(course, quiz, engine=None):
+    """
+    Reads the graded answers for a single course and quiz.
+
+    Args:
+        course (str): The course ID.
+        quiz (str): The quiz ID.
+        engine (Engine): The database engine, defaults to get_engine().
+
+    Returns:
+        subset (DataFrame): The rows for the given course and quiz.
+    """
+    engine = engine or get_engine()
+    columns = [graded_answers.c[column] for column in COLUMNS]
+    statement = (select(*columns)
+                 .where(graded_answers.c.course_id == int(course))
+                 .where(graded_answers.c.quiz_id == int(quiz))
+                 .order_by(graded_answers.c.id))
+    return _read(statement, engine)
+
+
+def read_score_counts(course, quiz, engine=None):
+    """
+    Reads the score histogram of every question of a course and quiz.
+
+    Args:
+        course (str): The course ID.
+        quiz (str): The quiz ID.
+        engine (Engine): The database engine, defaults to get_engine().
+
+    Returns:
+        counts (DataFrame): question_name, metric, score and count, one row per
+            score that at least one answer received.
+    """
+    engine = engine or get_engine()
+    statement = (select(score_counts.c.question_name, score_counts.c.metric,
+                        score_counts.c.score, score_counts.c.count)
+                 .where(score_counts.c.course_id == int(course))
+                 .where(score_counts.c.quiz_id == int(quiz))
+                 .order_by(score_counts.c.question_name, score_counts.c.metric, score_counts.c.score))
+    return _read(statement, engine)
+
+
+def read_quiz_title(course, quiz, engine=None):
+    """
+    Reads the title of a quiz from its graded answers.
+
+    Args:
+        course (str): The course ID.
+        quiz (str): The quiz ID.
+        engine (Engine): The database engine, defaults to get_engine().
+
+    Returns:
+        quiz_title (str): The quiz title, or None if no answer is stored.
+    """
+    engine = engine or get_engine()
+    statement = (select(graded_answers.c.quiz_title)
+                 .where(graded_answers.c.course_id == int(course))
+                 .where(graded_answers.c.quiz_id == int(quiz))
+                 .limit(1))
+    with engine.connect() as conn:
+        return conn.execute(statement).scalar()
+
+
+def read_page(course, quiz, columns=None, offset=0, limit=50, filters=None, search=None,
+              truncate=None, engine=None):
+    """
+    Reads one page of the graded answers of a quiz, filtered and with long text cut short.
+
+    Args:
+        course (str): The course ID.
+        quiz (str): The quiz ID.
+        columns (list): The columns to read, defaults to COLUMNS. The row id is always included.
+        offset (int): The number of matching rows to skip.
+        limit (int): The maximum number of rows to read.
+        filters (dict): Values that columns must equal, e.g. {'accuracy': 4}. Empty values are ignored.
+        search (str): Text that question_name or student_answer must contain (case-insensitive).
+        truncate (int): Text columns longer than this many characters are cut and end with '…'.
+        engine (Engine): The database engine, defaults to get_engine().
+
+    Returns:
+        page (DataFrame): The rows of the page, ordered by row id.
+        total (int): The number of rows matching the filters.
+    """
+    engine = engine or get_engine()
+    conditions = [graded_answers.c.course_id == int(course), graded_answers.c.quiz_id == int(quiz)]
+    for column, value in (filters or {}).items():
+        if value not in (None, ''):
+            conditions.append(graded_answers.c[column] == value)
+    if search:
+        pattern = f"%{search}%"
+        conditions.append(graded_answers.c.question_name.ilike(pattern)
+                          | graded_answers.c.student_answer.ilike(pattern))
+
+    selected = [graded_answers.c.id]
+    for column in (columns or COLUMNS):
+        column = graded_answers.c[column]
+        if truncate and isinstance(column.type, (String, Text)):
+            cut = func.substr(column, 1, truncate)
+            selected.append(case((func.length(column) > truncate, cut + '…'), else_=column).label(column.name))
+        else:
+            selected.append(column)
+
+    statement = (select(*selected).where(*conditions)
+                 .order_by(graded_answers.c.id).offset(int(offset)).limit(int(limit)))
+    with engine.connect() as conn:
+        total = conn.execute(select(func.count()).select_from(graded_answers).where(*conditions)).scalar()
+        page = pd.read_sql(statement, conn)
+    return page, total
+
+
+def read_answer(answer_id, engine=None):
+    """
+    Reads every column of a single graded answer.
+
+    Args:
+        answer_id (int): The row id of the answer.
+        engine (Engine): The database engine, defaults to get_engine().
+
+    Returns:
+        answer (dict): The answer keyed by COLUMNS, or None if there is no such row.
+    """
+    engine = engine or get_engine()
+    columns = [graded_answers.c[column] for column in COLUMNS]
+    with engine.connect() as conn:
+        row = conn.execute(select(*columns).where(graded_answers.c.id == int(answer_id))).mappings().first()
+    return dict(row) if row is not None else None
+
+
+def graded_keys(course, quiz, engine=None):
+    """
+    Reads the keys of every answer already graded for a course and quiz.
+
+    Args:
+        course (str): The course ID.
+        quiz (str): The quiz ID.
+        engine (Engine): The database engine, defaults to get_engine().
+
+    Returns:
+        keys (set): A set of (submission_id, question_id, attempt) tuples.
+    """
+    engine = engine or get_engine()
+    statement = (select(graded_answers.c.submission_id,
+                        graded_answers.c.history_id,
+                        graded_answers.c.attempt)
+                 .where(graded_answers.c.course_id == int(course))
+                 .where(graded_answers.c.quiz_id == int(quiz)))
+    with engine.connect() as conn:
+        return {tuple(row) for row in conn.execute(statement)}
+
+
+def get_watermark(course, quiz, engine=None):
+    """
+    Reads the sync high-water mark of a course and quiz.
+
+    Args:
+        course (str): The course ID.
+        quiz (str): The quiz ID.
+        engine (Engine): The database engine, defaults to get_engine().
+
+    Returns:
+        submitted_at (str): The latest submitted_at already synced, or None.
+    """
+    engine = engine or get_engine()
+    statement = (select(sync_watermarks.c.submitted_at)
+                 .where(sync_watermarks.c.course_id == int(course))
+                 .where(sync_watermarks.c.quiz_id == int(quiz)))
+    with engine.connect() as conn:
+        return conn.execute(statement).scalar()
+
+
+def set_watermark(course, quiz, submitted_at, engine=None):
+    """
+    Stores the sync high-water mark of a course and quiz.
+
+    Args:
+        course (str): The course ID.
+        quiz (str): The quiz ID.
+        submitted_at (str): The latest submitted_at that has been fully synced.
+        engine (Engine): The database engine, defaults to get_engine().
+    """
+    engine = engine or get_engine()
+    statement = insert(sync_watermarks).values(course_id=int(course),
+                                               quiz_id=int(quiz),
+                                               submitted_at=submitted_at)
+    statement = statement.on_conflict_do_update(index_elements=['course_id', 'quiz_id'],
+                                                set_={'submitted_at': submitted_at})
+    with engine.begin() as conn:
+        conn.execute(statement)
+
+
+def enqueue_jobs(jobs, engine=None):
+    """
+    Queues sync jobs. A quiz already waiting in the queue is left as is; finished
+    or failed jobs are queued again with their attempts reset.
+
+    Args:
+        jobs (list): A list of (course_id, quiz_id, quiz_title) tuples.
+        engine (Engine): The database engine, defaults to get_engine().
+    """
+    if not jobs:
+        return
+    engine = engine or get_engine()
+    now = datetime.now(timezone.utc).isoformat()
+    rows = [{'course_id': int(course), 'quiz_id': int(quiz), 'quiz_title': title,
+             'status': 'pending', 'attempts': 0, 'updated_at': now}
+            for course, quiz, title in jobs]
+    statement = insert(sync_jobs)
+    statement = statement.on_conflict_do_update(
+        index_elements=['course_id', 'quiz_id'],
+        set_={'status': 'pending', 'attempts': 0, 'error': None, 'quiz_title': statement.excluded.quiz_title,
+              'updated_at': now},
+        where=(sync_jobs.c.status == 'done') | (sync_jobs.c.status == 'failed'))
+    with engine.begin() as conn:
+        conn.execute(statement, rows)
+
+
+def claim_job(max_attempts=3, engine=None):
+    """
+    Marks the oldest unfinished job as running and returns it. Jobs left running
+    by an interrupted run are claimed again, or marked failed once they have used
+    up their attempts.
+
+    Args:
+        max_attempts (int): Jobs that already failed this many times are skipped.
+        engine (Engine): The database engine, defaults to get_engine().
+
+    Returns:
+        job (dict): The claimed job, or None if the queue is empty.
+    """
+    engine = engine or get_engine()
+    with engine.begin() as conn:
+        conn.execute(sync_jobs.update()
+                     .where(sync_jobs.c.status == 'running')
+                     .where(sync_jobs.c.attempts >= max_attempts)
+                     .values(status='failed',
+                             error=f"Interrupted on all {max_attempts} attempts",
+                             updated_at=datetime.now(timezone.utc).isoformat()))
+        job = conn.execute(select(sync_jobs)
+                           .where(sync_jobs.c.status.in_(['pending', 'running']))
+                           .where(sync_jobs.c.attempts < max_attempts)
+                           .order_by(sync_jobs.c.id)
+                           .limit(1)).mappings().first()
+        if job is None:
+            return None
+        conn.execute(sync_jobs.update()
+                     .where(sync_jobs.c.id == job['id'])
+                     .values(status='running',
+                             attempts=job['attempts'] + 1,
+                             updated_at=datetime.now(timezone.utc).isoformat()))
+        return dict(job)
+
+
+def finish_job(job_id, status, graded=None, error=None, engine=None):
+    """
+    Records the outcome of a sync job.
+
+    Args:
+        job_id (int): The job ID.
+        status (str): 'done', 'failed' or 'pending' (to retry).
+        graded (int): The number of answers graded by the job.
+        error (str): The error message of a failed job.
+        engine (Engine): The database engine, defaults to get_engine().
+    """
+    engine = engine or get_engine()
+    with engine.begin() as conn:
+        conn.execute(sync_jobs.update()
+                     .where(sync_jobs.c.id == job_id)
+                     .values(status=status, graded=graded, error=error,
+                             updated_at=datetime.now(timezone.utc).isoformat()))
+
+
+def job_counts(engine=None):
+    """
+    Counts the sync jobs in each status.
+
+    Args:
+        engine (Engine): The database engine, defaults to get_engine().
+
+    Returns:
+        counts (dict): The number of jobs keyed by status.
+    """
+    engine = engine or get_engine()
+    statement = select(sync_jobs.c.status, func.count()).group_by(sync_jobs.c.status)
+    with engine.connect() as conn:
+        return dict(conn.execute(statement).all())
+
+
+def read_group_means(quiz_group, engine=None):
+    """
+    Reads the mean of every score metric for each quiz title in a quiz group.
+    The means are computed from score_counts, so no answer rows are scanned.
+
+    Args:
+        quiz_group (str): The first word of the quiz titles.
+        engine (Engine): The database engine, defaults to get_engine().
+
+    Returns:
+        means (DataFrame): quiz_title, quiz_num and one column per metric, ordered by quiz_num.
+    """
+    engine = engine or get_engine()
+    total = func.sum(score_counts.c.score * score_counts.c.count)
+    statement = (select(quiz_index.c.quiz_title,
+                        func.min(quiz_index.c.quiz_num).label('quiz_num'),
+                        score_counts.c.metric,
+                        (total * 1.0 / func.sum(score_counts.c.count)).label('mean'))
+                 .join(score_counts, (score_counts.c.course_id == quiz_index.c.course_id)
+                                     & (score_counts.c.quiz_id == quiz_index.c.quiz_id))
+                 .where(quiz_index.c.quiz_group == quiz_group)
+                 .group_by(quiz_index.c.quiz_title, score_counts.c.metric))
+    means = _read(statement, engine)
+    wide = means.pivot(index='quiz_title', columns='metric', values='mean').reindex(columns=SCORE_METRICS)
+    wide.insert(0, 'quiz_num', means.groupby('quiz_title')['quiz_num'].first())
+    wide = wide.rename_axis(columns=None).reset_index()
+    return wide.sort_values('quiz_num', na_position='last', kind='stable').reset_index(drop=True)
+
+
+def read_course_quizzes(course, engine=None):
+    """
+    Reads the quizzes of a course that have graded answers.
+
+    Args:
+        course (str): The course ID.
+        engine (Engine): The database engine, defaults to get_engine().
+
+    Returns:
+        quizzes (dict): Quiz titles keyed by quiz ID, in quiz number order.
+    """
+    engine = engine or get_engine()
+    statement = (select(quiz_index.c.quiz_id, quiz_index.c.quiz_title)
+                 .where(quiz_index.c.course_id == int(course))
+                 .order_by(quiz_index.c.quiz_group, quiz_index.c.quiz_num, quiz_index.c.quiz_title))
+    with engine.connect() as conn:
+        return {str(quiz): title for quiz, title in conn.execute(statement)}
+
+
+def iter_answers(course, quizzes=None, chunk_size=5000, engine=None):
+    """
+    Streams the graded answers of a course, or of some of its quizzes, in chunks.
+    Rows are read from the database as the chunks are consumed, so memory use
+    does not grow with the number of answers.
+
+    Args:
+        course (str): The course ID.
+        quizzes (list): The quiz IDs to read, defaults to every quiz of the course.
+        chunk_size (int): The number of rows per chunk.
+        engine (Engine): The database engine, defaults to get_engine().
+
+    Yields:
+        chunk (DataFrame): Up to chunk_size rows with the COLUMNS, ordered by quiz and row id.
+    """
+    engine = engine or get_engine()
+    columns = [graded_answers.c[column] for column in COLUMNS]
+    statement = select(*columns).where(graded_answers.c.course_id == int(course))
+    if quizzes:
+        statement = statement.where(graded_answers.c.quiz_id.in_([int(quiz) for quiz in quizzes]))
+    statement = statement.order_by(graded_answers.c.quiz_id, graded_answers.c.id)
+    with engine.connect() as conn:
+        conn = conn.execution_options(stream_results=True)
+        yield from pd.read_sql(statement, conn, chunksize=chunk_size)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Import graded_quizzes.json into the SQLite store.")
+    parser.add_argument('--json', default=JSON_PATH, help="Path of the legacy JSON file.")
+    parser.add_argument('--db', default=DB_PATH, help="Path of the SQLite database.")
+    parser.add_argument('--rebuild-aggregates', action='store_true',
+                        help="Recompute the score_counts table from the stored answers.")
+    args = parser.parse_args()
+    print(f"Imported {import_json(args.json, get_engine(args.db))} graded answers into {args.db}")
+    if args.rebuild_aggregates:
+        rebuild_score_counts(get_engine(args.db))
+        print("Rebuilt score_counts")
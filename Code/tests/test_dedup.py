@@ -0,0 +1,37 @@
+# -*- coding: utf-8 -*-
+"""Answers that differ in meaning must never be merged by the duplicate check."""
+
+import pytest
+from dedup import DuplicateIndex, canonical_text
+
+PRELOAD = ("Increasing preload stretches the ventricle and increases the force of contraction. "
+           "As a result stroke volume rises, following the Frank-Starling law.")
+
+OPPOSITES = [
+    (PRELOAD, PRELOAD.replace("increases the force", "decreases the force")),
+    (PRELOAD, PRELOAD.replace("stroke volume rises", "stroke volume falls")),
+    ("Na+ influx depolarizes the cell", "Na- influx depolarizes the cell"),
+    ("preload ↑ stroke volume", "preload ↓ stroke volume"),
+    ("pH > 7.4", "pH < 7.4"),
+]
+
+
+@pytest.mark.parametrize('near', [False, True])
+@pytest.mark.parametrize('original, opposite', OPPOSITES)
+def test_opposite_answers_are_not_duplicates(near, original, opposite):
+    index = DuplicateIndex(near=near)
+    assert index.find_or_add(original, 'original') is None
+    assert index.find_or_add(opposite, 'opposite') is None
+
+
+@pytest.mark.parametrize('near', [False, True])
+def test_trivial_copies_are_duplicates(near):
+    index = DuplicateIndex(near=near)
+    index.find_or_add(PRELOAD, 'original')
+    assert index.find_or_add(PRELOAD.upper() + "  ", 'copy') == 'original'
+    assert index.find_or_add(PRELOAD.rstrip('.'), 'copy') == 'original'
+
+
+def test_canonical_text_keeps_symbols():
+    assert canonical_text("  Na+  influx.  ") == "na+ influx"
+    assert canonical_text("pH > 7.4") != canonical_text("pH < 7.4")